@@ -1,12 +1,12 @@
-import itertools, shutil, os, glob
+import shutil, os, glob
 
 from os.path import join as pjoin
 
-from doit.tools import LongRunning
+from doit.tools import config_changed
 
 from uristmaps import render_sat_layer, load_legends, load_biomes, filefinder, tilesets, \
                       load_structures, templates, uristcopy, group_structures, \
-                      load_pops
+                      load_pops, host, dist
 from uristmaps.config import conf
 
 
@@ -19,15 +19,16 @@ region_dir = conf["Paths"]["region"]
 tiles_dir = conf["Paths"]["tiles"]
 tilesets_dir = conf["Paths"]["tilesets"]
 
-DOIT_CONFIG = {"default_tasks": ["create_tilesets", "load_populations", "dist_sites", "render_sat", "index", "js_file", "biome_legend", "copy_res"]}
+DOIT_CONFIG = {"default_tasks": ["create_tilesets", "load_populations", "dist_sites", "marker_tiles", "search_index", "render_sat", "index", "js_file", "sprites", "copy_res", "dist"]}
 
 def task_read_biome_info():
-    """ Read biome info and write the biomes.json.
+    """ Read biome info and write the biomes grid and the world manifest.
     """
 
     return {
         "actions"   : [load_biomes.load],
-        "targets"   : [pjoin(build_dir, "biomes.json")],
+        "targets"   : [pjoin(build_dir, "biomes.npy"), pjoin(build_dir, "biomes_names.json"),
+                       pjoin(build_dir, "world.json")],
         "verbosity" : 2,
         "file_dep"  : [filefinder.biome_map()],
         "clean"     : True,
@@ -41,8 +42,20 @@ def task_load_sites():
         "actions"   : [load_legends.load_sites],
         "verbosity" : 2,
         "targets"   : [pjoin(build_dir, "sites.json")],
-        "file_dep"  : [filefinder.legends_xml(),
-                       pjoin(build_dir, "biomes.json")],
+        "file_dep"  : [filefinder.legends_xml()],
+        "clean"     : True,
+        }
+
+
+def task_ingest_legends():
+    """ Stream the legends.xml into the indexed legends database.
+    """
+
+    return {
+        "actions"   : [load_legends.ingest_legends],
+        "verbosity" : 2,
+        "targets"   : [pjoin(build_dir, "legends.sqlite")],
+        "file_dep"  : [filefinder.legends_xml()],
         "clean"     : True,
         }
 
@@ -99,85 +112,122 @@ def task_load_structures():
     return {
         "actions"   : [load_structures.load],
         "verbosity" : 2,
-        "targets"   : [pjoin(build_dir, "structs.json")],
+        "targets"   : [pjoin(build_dir, "structs.npy"), pjoin(build_dir, "structs_names.json")],
         "file_dep"  : [filefinder.struct_map()],
         "clean"     : True,
         }
 
 
 def task_group_structures():
-    """ Read the structure info and find connected groups.
+    """ Find the groups of connected structures and move the site markers
+    onto the center of the closest matching group.
     """
     return {
-        "actions"   : [group_structures.make_groups],
+        "actions"   : [group_structures.group_sites],
         "verbosity" : 2,
         "targets"   : [pjoin(build_dir, "groups.json")],
-        "file_dep"  : [pjoin(build_dir, "structs.json")],
+        "file_dep"  : [pjoin(build_dir, "structs.npy"), pjoin(build_dir, "structs_names.json"),
+                       pjoin(build_dir, "sites.json")],
         "clean"     : True,
     }
 
-def task_group_centers():
-    """ Read the structure groups and find a coordinate for the group's center.
+
+def task_place_site_markers():
+    """ Calculate the map-coordinates for the sites.
     """
+    file_dep = [pjoin(build_dir, "sites.json"),
+                pjoin(build_dir, "detailed_maps.json"),
+                pjoin(build_dir, "world.json")]
+
+    # The legends database is only read for the history in the popups
+    site_history = conf.getint("Map", "site_history", fallback=10)
+    if site_history > 0:
+        file_dep.append(pjoin(build_dir, "legends.sqlite"))
+
     return {
-        "actions"   : [group_structures.center_groups],
+        "actions"   : [load_legends.create_geojson],
         "verbosity" : 2,
-        "targets"   : [pjoin(build_dir, "group_centers.json")],
-        "file_dep"  : [pjoin(build_dir, "groups.json")],
+        "file_dep"  : file_dep,
+        "uptodate"  : [config_changed({"site_history": site_history})],
+        "targets"   : [pjoin(build_dir, "sitesgeo.json")],
+        "task_dep"  : ["group_structures"],
         "clean"     : True,
-        }
+    }
 
 
-def task_center_sites():
-    """ Iterate over all groups and see if a site marker is close to
-    the group. Move the site marker to the center of this group.
+def task_marker_tiles():
+    """ Cluster the site markers for each zoom level and split them up by map tile.
     """
-    return {
-       "actions"    : [group_structures.center_group_sites],
-       "verbosity"  : 2,
-       "file_dep"   : [pjoin(build_dir, "group_centers.json"),
-                       pjoin(build_dir, "sites.json")],
-       "clean"     : True,
+    settings = {"max_zoom": conf.getint("Map", "max_zoom"),
+                "max_cluster_radius": conf.getint("Map", "max_cluster_radius")}
+
+    yield {
+        "name"      : "compile",
+        "actions"   : [load_legends.create_marker_tiles],
+        "verbosity" : 2,
+        "file_dep"  : [pjoin(build_dir, "sitesgeo.json")],
+        "uptodate"  : [config_changed(settings)],
+        "clean"     : [(shutil.rmtree, (load_legends.marker_tiles_dir(),), {"ignore_errors": True})],
     }
 
+    yield {
+        "name"      : "dist",
+        # Drop the tiles of the last build that might not exist anymore
+        "actions"   : [(shutil.rmtree, (pjoin(output_dir, "js", "markers"),), {"ignore_errors": True}),
+                       (uristcopy.copy_dir, (load_legends.marker_tiles_dir(),
+                                             pjoin(output_dir, "js", "markers")))],
+        "verbosity" : 2,
+        "file_dep"  : [pjoin(build_dir, "sitesgeo.json")],
+        "uptodate"  : [config_changed(settings)],
+        "task_dep"  : ["marker_tiles:compile"],
+    }
 
-def task_place_site_markers():
-    """ Calculate the map-coordinates for the sites.
+
+def task_search_index():
+    """ Build the paged site list and the search index for the sidebar.
     """
-    return {
-        "actions"   : [load_legends.create_geojson],
+    yield {
+        "name"      : "compile",
+        "actions"   : [load_legends.create_search_index],
         "verbosity" : 2,
-        "file_dep"  : [pjoin(build_dir, "sites.json"),
-                       pjoin(build_dir, "detailed_maps.json")],
-        "targets"   : [pjoin(build_dir, "sitesgeo.json")],
-        "task_dep"  : ["center_sites"],
-        "clean"     : True,
+        "file_dep"  : [pjoin(build_dir, "sitesgeo.json"), pjoin(build_dir, "sites.json")],
+        "clean"     : [(shutil.rmtree, (load_legends.search_index_dir(),), {"ignore_errors": True})],
+    }
+
+    yield {
+        "name"      : "dist",
+        "actions"   : [(shutil.rmtree, (pjoin(output_dir, "js", "search"),), {"ignore_errors": True}),
+                       (uristcopy.copy_dir, (load_legends.search_index_dir(),
+                                             pjoin(output_dir, "js", "search")))],
+        "verbosity" : 2,
+        "file_dep"  : [pjoin(build_dir, "sitesgeo.json"), pjoin(build_dir, "sites.json")],
+        "task_dep"  : ["search_index:compile"],
     }
 
 
 def task_render_sat():
     """ Render the map layers for the 'satellite'-like view of the world.
+
+    All levels are rendered in one pass that loads the world only once.
     """
+    return {
+        "verbosity" : 2,
+        "actions"   : [render_sat_layer.render_all],
 
-    def list_tile_files(topdir, level):
-       """ Generate a complete list of the files that make up
-       the layer with the given zoom level in the topdir.
-       """
-       return [pjoin(topdir, str(level), str(x),"{}.png".format(y)) for \
-               (x,y) in itertools.product(range(level + 1), repeat=2)]
+        # TODO: Make this depend on the tilesheets for the imagesizes that would be used
+        #       for the zoom levels.
+        "file_dep"  : [pjoin(build_dir, "biomes.npy"), pjoin(build_dir, "biomes_names.json"),
+                       pjoin(build_dir, "structs.npy"), pjoin(build_dir, "structs_names.json"),
+                       pjoin(build_dir, "world.json")],
 
-    for i in range(1,conf.getint("Map","max_zoom") + 1):
-        yield {
-            "name"      : i,
-            "verbosity" : 2,
-            "actions"   : [(render_sat_layer.render_layer, (i,))],
+        # Tiles outside of the world are not rendered so the tile files can
+        # not be listed up front. The world snapshot is written when a level
+        # has been rendered completely.
+        "targets"   : [render_sat_layer.snapshot_file(conf.getint("Map","max_zoom"))],
 
-            # TODO: Make this depend on the tilesheet for the imagesize that would be used
-            #       for this zoom level.
-            "file_dep"  : [pjoin(build_dir, "biomes.json"),
-                           "{}/structs.json".format(build_dir)],
-            "targets"   : list_tile_files(pjoin(output_dir, "tiles"),i),
-        }
+        # Render again when the tiles are to be encoded differently
+        "uptodate"  : [config_changed(render_sat_layer.output_settings())],
+    }
 
 
 def task_dist_sites():
@@ -190,6 +240,11 @@ def task_dist_sites():
                      ),
                       (uristcopy.copy, (pjoin(build_dir, "sitesgeo.json"),
                               pjoin(output_dir, "js", "sitesgeo.json"))
+                     ),
+                      # Drop the files of the last build that might not exist anymore
+                      (shutil.rmtree, (pjoin(output_dir, "js", "site_details"),), {"ignore_errors": True}),
+                      (uristcopy.copy_dir, (pjoin(build_dir, "site_details"),
+                              pjoin(output_dir, "js", "site_details"))
                      )],
         "file_dep" : [pjoin(build_dir, "sites.json"),pjoin(build_dir, "sitesgeo.json")],
         "targets"  : [pjoin(output_dir, "js", "sites.json"),pjoin(output_dir, "js", "sitesgeo.json")],
@@ -226,9 +281,20 @@ def task_load_populations():
 def task_host():
     """ Start a web server hosting the contents of the output directory.
     """
-    cmd = "cd {} && python -m http.server".format(output_dir)
     return {
-        "actions" : [LongRunning(cmd)]
+        "actions"   : [host.serve],
+        "verbosity" : 2,
+    }
+
+
+def task_dist():
+    """ Give the scripts and stylesheets names with their content hash and
+    precompress the text files of the output directory.
+    """
+    return {
+        "actions"   : [(dist.make_dist, ("res", build_dir, output_dir))],
+        "verbosity" : 2,
+        "task_dep"  : ["index", "js_file", "copy_res", "sprites", "dist_sites", "marker_tiles", "search_index"],
     }
 
 
@@ -242,13 +308,27 @@ def task_copy_res():
     }
 
 
-def task_biome_legend():
-    """ Copy 32px images for biome rendering into the output dir.
+def task_sprites():
+    """ Pack the site icons and the 32px biome images for the legend into
+    sprite sheets with their stylesheets in the output dir.
     """
-    return {
-        "actions"   : [(uristcopy.copy_dir, (pjoin(tiles_dir, "32"),
-                                   pjoin(output_dir, "biome_legend")))],
+    icons = sorted(glob.glob(pjoin("res", "icons", "*.png")))
+    yield {
+        "name"      : "icons",
+        "actions"   : [(tilesets.make_sprites, ("icons", icons, 35, pjoin(output_dir, "sprites")))],
+        "verbosity" : 2,
+        "file_dep"  : icons,
+        "targets"   : [pjoin(output_dir, "sprites", "icons.png"), pjoin(output_dir, "sprites", "icons.css")],
+        "clean"     : True,
+    }
+
+    legend = templates.legend_images()
+    yield {
+        "name"      : "biomes",
+        "actions"   : [(tilesets.make_sprites, ("biomes", legend, 32, pjoin(output_dir, "sprites")))],
         "verbosity" : 2,
+        "file_dep"  : legend,
+        "targets"   : [pjoin(output_dir, "sprites", "biomes.png"), pjoin(output_dir, "sprites", "biomes.css")],
         "clean"     : True,
     }
 
@@ -1,13 +1,15 @@
 /* Icon definitions */
+/* The icons are shown from the sprite sheet in /sprites/icons.css */
 var icons = {};
-function get_icon(url) {
-  if (icons[url] === undefined) {
-    var icon = L.icon({
-      "iconUrl" : url,
+function get_icon(site_type) {
+  var name = site_type.replace(/ /g, "_");
+  if (icons[name] === undefined) {
+    var icon = L.divIcon({
+      "className" : "sprite-icons sprite-icons-" + name,
       "iconSize": [35, 35],
       "iconAnchor": [17, 17]
     });
-    icons[url] = icon;
+    icons[name] = icon;
   }
-  return icons[url];
+  return icons[name];
 }
\ No newline at end of file
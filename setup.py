@@ -14,6 +14,7 @@ setup(name="UristMaps",
                         "clint",          # Pretty cli output
                         "doit",           # Quick management of tasks and execution order
                         "Jinja2",          # Rendering html files
+                        "numpy",          # Tile compositing
      ]
 )
 
@@ -2,8 +2,32 @@
 // Global reference to the map object
 var map;
 
-// Stores the loaded json with the sites
-var sites_geojson;
+// Layer holding the site markers of the visible map tiles
+var markers_layer;
+
+// Maps "z/x/y" of each map tile whose markers were requested to the layer
+// group with its markers. The markers are clustered per zoom level when
+// the map is built and stored in one file per map tile.
+var marker_tiles = {};
+
+// Maps each zoom level to the jQuery promise of the set of "x/y" keys of
+// its map tiles with markers. Only these tiles have a marker file.
+var marker_indexes = {};
+
+// Maps the number of each loaded site details file to the jQuery
+// promise of its contents. The details of a site are in the file
+// site_id / site_shard_size.
+var site_shards = {};
+var site_shard_size = {{ site_shard_size }};
+
+// Number of sites shown at once in the site list and the length of the
+// word prefixes the search index is split up by
+var search_page_size = {{ search_page_size }};
+var search_prefix_length = {{ search_prefix_length }};
+
+// Maps the paths of the requested search index files to the jQuery promise
+// of their contents
+var search_files = {};
 
 // Sidebar objects
 var leftbar;
@@ -15,16 +39,16 @@ var btn_sitelist;
 // Initializes the map and triggers and loads the sites.
 function init_uristmaps() {
     map = L.map('map').setView([0, 0], 3);
-    L.tileLayer('/tiles/{z}/{x}/{y}.png', {
+    L.tileLayer('/tiles/{z}/{x}/{y}.{{ tile_extension }}', {
         noWrap: true,
         maxZoom: {{ max_zoom }},
         attribution: "<a href='http://www.uristmaps.org/'>UristMaps {{ version }}</a>",
     }).addTo(map);
     window.map = map;
 
-    // Load the sites json containing short info for every site
-    jQuery.getJSON("/js/sitesgeo.json", process_loaded_sites);
-    
+    window.active_site_maps = {};
+    setup_markers();
+
     setup_sidebars();
     init_buttons();
 };
@@ -78,59 +102,304 @@ function toggle_detailed_map(site_id) {
         // Create the overlay and add it to active_site_maps
         var image_url = "/sites/" + site_id + ".png";
 
-        // the .features object is a list in which the index is resolved as id-1
-        for (var i = 0; i < window.sites_geojson.features.length; i++) {
-            var site = window.sites_geojson.features[i];
-            if (site.properties.id != site_id) {
-                continue;
-            }
-            var overlay = L.imageOverlay(image_url, site.properties.map_bounds);
+        load_site_details(site_id, function(details) {
+            var overlay = L.imageOverlay(image_url, details.map_bounds);
             window.active_site_maps[site_id] = overlay;
             overlay.addTo(window.map);
-            break;
-        }
+        });
     }
 }
 
 /**
- * When the sites json is loaded, create the cluster group for 
- * all site markers.
+ * Call callback with the details (popup content and detailed map bounds)
+ * of the site. The details file containing the site is only loaded once.
  */
-function process_loaded_sites(data) {
-    sites_geojson = data;
-    window.sites_geojson = data;
-    window.active_site_maps = {};
-  
-    // Create a cluster group to better show the site icons
-    var clusters = new L.MarkerClusterGroup({
-        maxClusterRadius: {{ max_cluster_radius }}
-    });
-
-    // Convert geojson info to clustered markers
-    var points = L.geoJson(null, {
-        pointToLayer: function (feature, latlng) {
-            var marker = L.marker(latlng, {icon: get_icon(feature.properties.img)});
-            if (feature.properties && feature.properties.popupContent) {
-                marker.bindPopup(feature.properties.popupContent);
+function load_site_details(site_id, callback) {
+    var shard = Math.floor(site_id / site_shard_size);
+    if (site_shards[shard] === undefined) {
+        site_shards[shard] = jQuery.getJSON("/js/site_details/" + shard + ".json");
+    }
+    site_shards[shard].done(function(details) {
+        callback(details[site_id]);
+    });
+}
+
+/**
+ * Create the layer for the site markers and keep it filled with the markers
+ * of the visible part of the map.
+ */
+function setup_markers() {
+    markers_layer = L.layerGroup().addTo(map);
+    map.on("moveend", update_markers);
+    update_markers();
+
+    var icon_layer = {"Sites": markers_layer};
+    L.control.layers({}, icon_layer).addTo(map);
+};
+
+/**
+ * Show the markers of the map tiles in view and remove all others.
+ */
+function update_markers() {
+    var zoom = map.getZoom();
+    load_marker_index(zoom).done(function(index) {
+        // The map might have been zoomed while the index was loading
+        if (zoom === map.getZoom()) {
+            show_marker_tiles(zoom, index);
+        }
+    });
+};
+
+/**
+ * Load the keys of the map tiles with markers of the zoom level once.
+ */
+function load_marker_index(zoom) {
+    if (marker_indexes[zoom] === undefined) {
+        marker_indexes[zoom] = jQuery.getJSON("/js/markers/" + zoom + "/index.json").then(function(keys) {
+            var index = {};
+            $.each(keys, function(i, key) {
+                index[key] = true;
+            });
+            return index;
+        });
+    }
+    return marker_indexes[zoom];
+};
+
+/**
+ * Show the markers of the map tiles in view that have markers according to
+ * the index of the zoom level and remove all others.
+ */
+function show_marker_tiles(zoom, index) {
+    var bounds = map.getPixelBounds();
+    var min = bounds.min.divideBy(256).floor();
+    var max = bounds.max.divideBy(256).floor();
+    var tiles = Math.pow(2, zoom);
+
+    var visible = {};
+    for (var x = Math.max(min.x, 0); x <= Math.min(max.x, tiles - 1); x++) {
+        for (var y = Math.max(min.y, 0); y <= Math.min(max.y, tiles - 1); y++) {
+            if (!index[x + "/" + y]) {
+                continue;
             }
-            clusters.addLayer(marker);
-            return clusters;
+            var key = zoom + "/" + x + "/" + y;
+            visible[key] = true;
+            if (marker_tiles[key] === undefined) {
+                marker_tiles[key] = load_marker_tile(key);
+            }
+            markers_layer.addLayer(marker_tiles[key]);
         }
+    }
+
+    for (var key in marker_tiles) {
+        if (!visible[key]) {
+            markers_layer.removeLayer(marker_tiles[key]);
+        }
+    }
+};
+
+/**
+ * Create the layer group for the markers of the map tile. The markers are
+ * added when the tile file is loaded.
+ */
+function load_marker_tile(key) {
+    var group = L.layerGroup();
+    jQuery.getJSON("/js/markers/" + key + ".json", function(markers) {
+        $.each(markers, function(index, marker) {
+            if (marker.count === undefined) {
+                group.addLayer(site_marker(marker));
+            } else {
+                group.addLayer(cluster_marker(marker));
+            }
+        });
     });
-    $.each(data.features, function(fid, feature) {
-        points.addData(feature);
+    return group;
+};
+
+/**
+ * The marker of a single site. Its popup content is loaded when the popup
+ * is opened for the first time.
+ */
+function site_marker(site) {
+    var marker = L.marker([site.lat, site.lon], {
+        icon: get_icon(site.type),
+        title: site.name,
     });
-    map.addLayer(clusters);
-    
-    // Add 
-    var icon_layer = {"Sites": clusters};
-    L.control.layers({}, icon_layer).addTo(map);
+
+    marker.bindPopup("Loading...");
+    marker.on("popupopen", function(event) {
+        if (marker.details_loaded) {
+            return;
+        }
+        load_site_details(site.id, function(details) {
+            marker.details_loaded = true;
+            event.popup.setContent(details.popupContent);
+        });
+    });
+    return marker;
+};
+
+/**
+ * The marker of a cluster of sites that zooms onto the sites when clicked.
+ * Looks like the markers of Leaflet.markercluster.
+ */
+function cluster_marker(cluster) {
+    var size = "small";
+    if (cluster.count >= 100) {
+        size = "large";
+    } else if (cluster.count >= 10) {
+        size = "medium";
+    }
+
+    var marker = L.marker([cluster.lat, cluster.lon], {
+        icon: L.divIcon({
+            html: "<div><span>" + cluster.count + "</span></div>",
+            className: "marker-cluster marker-cluster-" + size,
+            iconSize: new L.Point(40, 40),
+        }),
+    });
+    marker.on("click", function() {
+        map.fitBounds(cluster.bounds);
+    });
+    return marker;
+};
+
+/**
+ * Load a file of the search index (see uristmaps/search.py), each file
+ * is only requested once.
+ */
+function load_search_file(path) {
+    if (search_files[path] === undefined) {
+        search_files[path] = jQuery.getJSON("/js/search/" + path + ".json");
+    }
+    return search_files[path];
+};
+
+/**
+ * Split the text into lowercase words without accents, the same way the
+ * search index was built.
+ */
+function search_words(text) {
+    return text.toLowerCase().normalize("NFKD").replace(/[\u0300-\u036f]/g, "")
+        .split(/[^a-z0-9]+/).filter(function(word) { return word.length > 0; });
+};
+
+function title_case(text) {
+    return text.replace(/\b\w/g, function(letter) { return letter.toUpperCase(); });
+};
+
+/**
+ * Show the list of site types in the sidebar.
+ */
+function show_site_types() {
+    load_search_file("types").done(function(types) {
+        var list = $("<ul class='list-unstyled'>");
+        $.each(types, function(index, type) {
+            var button = $("<button class='btn btn-link btn-xs'>")
+                .text(title_case(type.type) + " (" + type.count + ")")
+                .click(function() { show_type_page(type, 0); });
+            list.append($("<li>").append(button));
+        });
+        $("#site-list").empty().append(list);
+    });
+};
+
+function show_type_page(type, page) {
+    load_search_file("types/" + type.key + "/" + page).done(function(sites) {
+        show_sites(title_case(type.type) + " (" + type.count + ")", sites, page, type.pages,
+                   function(page) { show_type_page(type, page); });
+    });
+};
+
+/**
+ * Show the sites matching the query. Every word of the query has to be the
+ * start of a word of the name, type or owner of the site.
+ */
+function search_sites(query) {
+    var words = search_words(query);
+    if (words.length == 0) {
+        show_site_types();
+        return;
+    }
+
+    // The sites are looked up in the index file of the first long enough word
+    var long_words = words.filter(function(word) { return word.length >= search_prefix_length; });
+    if (long_words.length == 0) {
+        $("#site-list").empty().append($("<p>").text("Keep typing to search."));
+        return;
+    }
+    var prefix = long_words[0].substr(0, search_prefix_length);
+
+    load_search_file("prefix/" + prefix).always(function(sites) {
+        // Ignore the results when the query has changed in the meantime
+        if ($("#site-search").val() != query) {
+            return;
+        }
+        // There is no file if no site has a word with the prefix
+        if (!$.isArray(sites)) {
+            sites = [];
+        }
+        var found = sites.filter(function(site) {
+            var site_words = search_words(site.name + " " + site.type + " " + (site.owner || ""));
+            return words.every(function(word) {
+                return site_words.some(function(site_word) { return site_word.indexOf(word) == 0; });
+            });
+        });
+        show_search_page(found, 0);
+    });
+};
+
+function show_search_page(found, page) {
+    var pages = Math.ceil(found.length / search_page_size);
+    var sites = found.slice(page * search_page_size, (page + 1) * search_page_size);
+    show_sites("Found " + found.length + " sites", sites, page, pages,
+               function(page) { show_search_page(found, page); });
+};
+
+/**
+ * Show one page of sites in the sidebar. goto_page is called with the
+ * number of the page to show when the page is changed.
+ */
+function show_sites(title, sites, page, pages, goto_page) {
+    var back = $("<button class='btn btn-link btn-xs'>").text("All sites").click(function() {
+        $("#site-search").val("");
+        show_site_types();
+    });
+
+    var list = $("<ul class='list-unstyled'>");
+    $.each(sites, function(index, site) {
+        var button = $("<button class='btn btn-link btn-xs site-btn'>")
+            .attr("data-lat", site.lat)
+            .attr("data-lon", site.lon)
+            .attr("title", site.owner ? title_case(site.type) + " of " + site.owner : title_case(site.type))
+            .text(title_case(site.name));
+        list.append($("<li>").append(button));
+    });
+
+    var pager = $("<div>");
+    if (pages > 1) {
+        var previous = $("<button class='btn btn-default btn-xs'>").text("<")
+            .prop("disabled", page == 0)
+            .click(function() { goto_page(page - 1); });
+        var next = $("<button class='btn btn-default btn-xs'>").text(">")
+            .prop("disabled", page >= pages - 1)
+            .click(function() { goto_page(page + 1); });
+        pager.append(previous, " Page " + (page + 1) + " of " + pages + " ", next);
+    }
+
+    $("#site-list").empty().append(back, $("<h4>").text(title), list, pager);
 };
 
 $(function() {
-    $(".site-btn").click(function() {
-        var lat = $(this).attr("data-lat");
-        var lon = $(this).attr("data-lon");
+    $("#site-list").on("click", ".site-btn", function() {
+        var lat = parseFloat($(this).attr("data-lat"));
+        var lon = parseFloat($(this).attr("data-lon"));
         map.fitBounds([[lat,lon],[lat+0.01, lon+0.01]]);
     });
+
+    $("#site-search").on("input", function() {
+        search_sites($(this).val());
+    });
+
+    show_site_types();
 });
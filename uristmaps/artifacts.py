@@ -0,0 +1,40 @@
+""" Read and write the world maps extracted from the exports.
+
+Each map is stored as a grid of indices in <name>.npy (indexed [y, x]) and
+the list of names these indices refer to in <name>_names.json. The grids are
+memory-mapped when they are loaded, so loading is nearly instant and all
+processes reading the same grid share its pages.
+"""
+import os, json
+
+import numpy as np
+
+from uristmaps.config import conf
+
+
+def grid_file(name):
+    return os.path.join(conf["Paths"]["build"], "{}.npy".format(name))
+
+
+def names_file(name):
+    return os.path.join(conf["Paths"]["build"], "{}_names.json".format(name))
+
+
+def save_grid(name, grid, names):
+    """ Write the index grid and its name table into the build directory.
+    """
+    os.makedirs(conf["Paths"]["build"], exist_ok=True)
+    np.save(grid_file(name), grid)
+    with open(names_file(name), "w") as namesjson:
+        namesjson.write(json.dumps(names))
+
+
+def load_grid(name):
+    """ Load the index grid and its name table.
+
+    Returns the tuple (grid, names). The grid is read-only.
+    """
+    grid = np.load(grid_file(name), mmap_mode="r")
+    with open(names_file(name)) as namesjson:
+        names = json.loads(namesjson.read())
+    return grid, names
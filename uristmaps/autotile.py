@@ -0,0 +1,96 @@
+""" Decode the structure map and name the structure tiles after their
+neighbours of the same type.
+"""
+import numpy as np
+
+from uristmaps import bmpdecode
+
+
+STRUCTS = {
+    (128,128,128): "castle",
+    (255,255,255): "village",
+    (255,128,0)  : "crops",
+    (255,160,0)  : "crops",
+    (255,192,0)  : "crops",
+    (0,255,0)    : "pasture",
+    (64,255,0)   : "meadow",
+    (0,160,0)    : "orchard",
+    (20,20,20)   : "tunnel",
+    (224,224,224): "stone_bridge",
+    (180,167,20) : "other_bridge",
+    (192,192,192): "stone_road",
+    (150,127,20) : "other_road",
+    (96,96,96)   : "stone_wall",
+    (160,127,20) : "other_wall",
+    (0,96,255)   : "lake",
+# The following are not really 'structures'
+#    (255,255,192): "mountain",
+#    (128,64,32)  : "land",# remove this?
+#    (0,64,255)   : "ocean",# remove this?
+#
+}
+
+RIVERS = {
+    (0,224,255)  : "river",
+    (0,255,255)  : "river",
+    (0,112,255)  : "river",
+}
+
+# Bits of the neighbour mask of a tile and their suffix in the tile names
+# in the order the suffixes are appended.
+NEIGHBOURS = [(1, "n"), (2, "w"), (4, "s"), (8, "e")]
+
+
+def decode_structures(struct_rgb, hydro_rgb):
+    """ Decode the rgb arrays of the structure and hydro maps.
+
+    Returns the tuple (grid, names, unknown) with the indices of the
+    structure types in names, 0 for no (known) structure, and the unknown
+    colors of the structure map. Rivers overwrite the structures.
+    """
+    # Index 0 is the empty name for the tiles without a (known) structure
+    names = [""] + sorted(set(STRUCTS.values())) + ["river"]
+    struct_index = {color: names.index(name) for color, name in STRUCTS.items()}
+
+    # Most of the other colors are the landscape, we are not interested in them
+    grid, unknown = bmpdecode.decode(struct_rgb, struct_index)
+
+    rivers, _ = bmpdecode.decode(hydro_rgb, {color: 1 for color in RIVERS})
+    grid[rivers == 1] = names.index("river")
+    return grid, names, unknown
+
+
+def autotile(grid, names):
+    """ Find the neighbours of the same type for all tiles at once.
+
+    grid contains the indices of the structure types in names, 0 for no
+    structure. Tiles that have at least one neighbour of the same type
+    (outside of the map does not count) are named "<type>_<suffixes>",
+    for example village_nwe. All other tiles are dropped.
+
+    Returns the tuple (grid, names) of the named tiles with the index 0
+    being the empty name.
+    """
+    same_v = (grid[1:, :] != 0) & (grid[1:, :] == grid[:-1, :])
+    same_h = (grid[:, 1:] != 0) & (grid[:, 1:] == grid[:, :-1])
+
+    mask = np.zeros(grid.shape, dtype=np.uint8)
+    mask[1:, :] |= same_v * np.uint8(1)   # n
+    mask[:, 1:] |= same_h * np.uint8(2)   # w
+    mask[:-1, :] |= same_v * np.uint8(4)  # s
+    mask[:, :-1] |= same_h * np.uint8(8)  # e
+
+    # Name each combination of type and mask that occurs in the map
+    codes = grid.astype(np.uint32) * 16 + mask
+    used = np.unique(codes[mask != 0])
+    tile_names = {}
+    for code in used.tolist():
+        suffixes = "".join(suffix for bit, suffix in NEIGHBOURS if code & bit)
+        tile_names[code] = "{}_{}".format(names[code // 16], suffixes)
+
+    final_names = [""] + sorted(set(tile_names.values()))
+    lookup = np.zeros(len(names) * 16, dtype=np.uint16)
+    for code, name in tile_names.items():
+        lookup[code] = final_names.index(name)
+
+    return lookup[codes], final_names
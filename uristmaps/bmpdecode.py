@@ -0,0 +1,63 @@
+""" Decode the bitmap maps exported by Dwarf Fortress.
+
+The maps encode their categories (biomes, structures, rivers...) as colors.
+The image is read into an array once and every pixel is translated into the
+index of its category with a single vectorized lookup.
+"""
+import logging
+
+import numpy as np
+
+from PIL import Image
+
+
+def read_rgb(fname):
+    """ Read the image file into an (h, w, 3) uint8 array.
+    """
+    with Image.open(fname) as image:
+        return np.asarray(image.convert("RGB"))
+
+
+def pack(rgb):
+    """ Pack the channels of the (..., 3) color array into one uint32 per color.
+    """
+    rgb = rgb.astype(np.uint32)
+    return (rgb[..., 0] << 16) | (rgb[..., 1] << 8) | rgb[..., 2]
+
+
+def unpack(packed):
+    """ Turn a packed color back into its (r, g, b) tuple.
+    """
+    packed = int(packed)
+    return (packed >> 16) & 255, (packed >> 8) & 255, packed & 255
+
+
+def decode(rgb, colors, default=0, dtype=np.uint8):
+    """ Translate the colors of the (h, w, 3) image array into indices.
+
+    colors maps the (r, g, b) tuples to their index. Pixels with any other
+    color get the default index.
+    Returns the tuple (grid, unknown): The (h, w) index grid and a dict
+    mapping the colors that are not in colors to their amount of pixels.
+    """
+    packed = pack(rgb)
+    table = sorted((int(pack(np.array(color))), index) for color, index in colors.items())
+    keys = np.array([key for key, index in table], dtype=np.uint32)
+    values = np.array([index for key, index in table], dtype=dtype)
+
+    positions = np.searchsorted(keys, packed)
+    np.minimum(positions, len(keys) - 1, out=positions)
+    known = keys[positions] == packed
+
+    grid = np.where(known, values[positions], np.array(default, dtype=dtype))
+
+    unknown_colors, counts = np.unique(packed[~known], return_counts=True)
+    unknown = {unpack(color): int(count) for color, count in zip(unknown_colors, counts)}
+    return grid, unknown
+
+
+def report_unknown(unknown, label, level=logging.WARNING):
+    """ Log the unknown colors found by decode.
+    """
+    for color, count in sorted(unknown.items(), key=lambda item: -item[1]):
+        logging.log(level, "Unknown color {} in the {} ({} pixels)".format(color, label, count))
@@ -0,0 +1,61 @@
+""" Connected component labelling of typed grids.
+
+Uses a union-find over the edges between neighbouring cells of the same
+type. The unions of all edges are done at once with numpy: each pass hooks
+the larger of two roots under the smaller one and then compresses the paths
+by pointer jumping until every cell points at its root.
+"""
+import numpy as np
+
+# Neighbours (dx, dy) that connect the cells of a group: right, below and right-below
+DEFAULT_NEIGHBOURS = ((1, 0), (0, 1), (1, 1))
+
+
+def label_components(types, neighbours=DEFAULT_NEIGHBOURS):
+    """ Find the groups of connected cells of the same type.
+
+    types is an integer grid indexed [y, x] in which 0 means there is no
+    cell. Cells of the same type are connected when one is at the offset
+    (dx, dy) of the other for any of the given neighbours. The offsets may
+    not be negative.
+
+    Returns the tuple (labels, count). labels is a grid of the shape of
+    types with 0 for no cell and the group number 1..count of all other
+    cells. The groups are numbered in the order of their first cell when
+    the grid is scanned column by column.
+    """
+    # Work on the transposed grid so the flat indices run column by column
+    grid = np.ascontiguousarray(np.asarray(types).T)
+    width, height = grid.shape
+    flat = np.arange(grid.size).reshape(grid.shape)
+
+    cells = np.flatnonzero(grid)
+    edges_from, edges_to = [], []
+    for dx, dy in neighbours:
+        here = grid[:width - dx, :height - dy]
+        there = grid[dx:, dy:]
+        same = (here != 0) & (here == there)
+        edges_from.append(flat[:width - dx, :height - dy][same])
+        edges_to.append(flat[dx:, dy:][same])
+
+    # Number the cells 0..n in scan order, the root of each group will be its first cell
+    edges_from = np.searchsorted(cells, np.concatenate(edges_from))
+    edges_to = np.searchsorted(cells, np.concatenate(edges_to))
+
+    parent = np.arange(len(cells))
+    while True:
+        roots_from, roots_to = parent[edges_from], parent[edges_to]
+        if (roots_from == roots_to).all():
+            break
+        np.minimum.at(parent, np.maximum(roots_from, roots_to), np.minimum(roots_from, roots_to))
+
+        while True:
+            grandparent = parent[parent]
+            if (grandparent == parent).all():
+                break
+            parent = grandparent
+
+    roots, numbers = np.unique(parent, return_inverse=True)
+    labels = np.zeros(grid.size, dtype=np.uint32)
+    labels[cells] = numbers + 1
+    return labels.reshape(grid.shape).T.copy(), len(roots)
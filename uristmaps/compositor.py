@@ -0,0 +1,105 @@
+""" Composite map tiles out of a tileset atlas with numpy array operations.
+
+The world is described by two index grids (biomes and structures) that point
+into a list of tile names, the structure indices with an offset. The atlas
+stacks the tile image for each of these names into one array so a whole map
+tile can be built with a few gathers instead of pasting every single world
+tile.
+"""
+import numpy as np
+
+from PIL import Image
+
+# Color of the map area that is not covered by the world
+BACKGROUND = (255, 255, 255, 255)
+
+
+def build_atlas(tiles, names, size):
+    """ Create the atlas array for the given tile images.
+
+    tiles is the {image_name : PIL.Image} dict from tilesets.get_tileset and names
+    the list of tile names the index grids refer to. The result has the shape
+    (len(names), size, size, 4) and atlas[i] is the RGBA image of names[i].
+    Names without an image in the tileset (like the empty name "") stay fully
+    transparent.
+    """
+    atlas = np.zeros((len(names), size, size, 4), dtype=np.uint8)
+    for index, name in enumerate(names):
+        if name in tiles:
+            atlas[index] = np.asarray(tiles[name].convert("RGBA"))
+    return atlas
+
+
+def gather(atlas, grid):
+    """ Replace every index in the (h, w) grid with its atlas image and return
+    the resulting (h * size, w * size, 4) image array.
+    """
+    h, w = grid.shape
+    size = atlas.shape[1]
+    return atlas[grid].transpose(0, 2, 1, 3, 4).reshape(h * size, w * size, 4)
+
+
+def blend(base, over):
+    """ Paste the over image onto the base image using its alpha channel as mask.
+
+    Uses the same integer arithmetic as PIL's Image.paste(im, box, im) so the
+    result is identical to pasting the structure sprites one by one.
+    """
+    alpha = over[..., 3:4].astype(np.uint32)
+    tmp = base.astype(np.uint32) * (255 - alpha) + over.astype(np.uint32) * alpha + 128
+    return (((tmp >> 8) + tmp) >> 8).astype(np.uint8)
+
+
+def composite(atlas, biome_grid, struct_grid, left, top, cells, struct_offset=0):
+    """ Render the square block of cells x cells world tiles whose upper left
+    corner is at the world coordinate (left, top).
+
+    The structure index s refers to atlas[struct_offset + s], the index 0
+    means there is no structure.
+
+    The coordinates may lie outside of the world (negative or beyond the grid)
+    in which case these parts are filled with the background color.
+    Returns an RGBA image array of (cells * size, cells * size, 4).
+    """
+    size = atlas.shape[1]
+    worldsize = biome_grid.shape[0]
+    result = np.empty((cells * size, cells * size, 4), dtype=np.uint8)
+    result[...] = BACKGROUND
+
+    # Clip the requested block to the world
+    x0, y0 = max(left, 0), max(top, 0)
+    x1, y1 = min(left + cells, worldsize), min(top + cells, worldsize)
+    if x0 >= x1 or y0 >= y1:
+        return result
+
+    image = gather(atlas, biome_grid[y0:y1, x0:x1])
+
+    structs = struct_grid[y0:y1, x0:x1]
+    if structs.any():
+        image = blend(image, gather(atlas, structs + struct_offset))
+
+    px, py = (x0 - left) * size, (y0 - top) * size
+    result[py:py + image.shape[0], px:px + image.shape[1]] = image
+    return result
+
+
+def make_palette(atlases):
+    """ Determine a palette of at most 256 colors for the tiles rendered from
+    the given atlases.
+
+    When the tile images and the background use at most 256 colors these
+    colors are the palette. Otherwise the colors are quantized to 256.
+    Returns the palette as list of (r, g, b) tuples.
+    """
+    colors = [np.array([BACKGROUND[:3]], dtype=np.uint8)]
+    for atlas in atlases:
+        pixels = atlas.reshape(-1, 4)
+        # Fully transparent pixels never show up in a tile
+        colors.append(pixels[pixels[:, 3] > 0][:, :3])
+    colors = np.unique(np.concatenate(colors), axis=0)
+
+    if len(colors) > 256:
+        image = Image.fromarray(colors.reshape(1, -1, 3), "RGB").quantize(256)
+        colors = np.array(image.getpalette()[:256 * 3], dtype=np.uint8).reshape(-1, 3)
+
+    return [tuple(color) for color in colors.tolist()]
@@ -0,0 +1,144 @@
+""" Prepare the output directory to be served with long cache lifetimes.
+
+The scripts and stylesheets the index.html loads are copied to names that
+contain a hash of their content (urist.js becomes urist.1a2b3c4d.js) and the
+references in urist.js and index.html are changed to these names. The same
+is done for the sprite sheets and the references in their stylesheets. A changed
+file gets a new name, so the browser can keep the files forever.
+
+All text files of the output directory get precompressed .gz siblings and
+.br siblings when the brotli module is installed. The host sends these to
+the browsers that accept them.
+"""
+import os, re, glob, gzip, hashlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Extensions of the files that are precompressed
+COMPRESS_EXTENSIONS = (".html", ".js", ".css", ".json", ".svg", ".txt")
+
+# Amount of hex digits of the content hash in the file names
+HASH_LENGTH = 8
+
+# Matches file names with a content hash
+fingerprint_re = re.compile(r"^(.*)\.([0-9a-f]{{{}}})(\.[^.]+)$".format(HASH_LENGTH))
+
+# Matches the suffix of the precompressed siblings
+compressed_re = re.compile(r"\.(gz|br)$")
+
+
+def fingerprint(url, data):
+    """ Add the hash of the data to the file name of the url.
+    """
+    stem, ext = os.path.splitext(url)
+    return "{}.{}{}".format(stem, hashlib.sha1(data).hexdigest()[:HASH_LENGTH], ext)
+
+
+def rewrite(text, renames):
+    """ Replace the references to the urls in the renames dict with their new urls.
+    Only quoted urls are replaced.
+    """
+    for url, new_url in renames.items():
+        for quote in ("\"", "'"):
+            text = text.replace(quote + url + quote, quote + new_url + quote)
+    return text
+
+
+def write_fingerprinted(output_dir, url, data):
+    """ Write the data to the fingerprinted name of the url in the output
+    directory and remove the older versions of the file. Returns the new url.
+    """
+    new_url = fingerprint(url, data)
+    fname = os.path.join(output_dir, new_url.lstrip("/"))
+    directory = os.path.dirname(fname)
+    os.makedirs(directory, exist_ok=True)
+
+    # Remove the other versions of the file and their compressed siblings
+    stem, ext = os.path.splitext(os.path.basename(url))
+    for old in os.listdir(directory):
+        match = fingerprint_re.match(compressed_re.sub("", old))
+        if match and (match.group(1), match.group(3)) == (stem, ext) \
+           and not old.startswith(os.path.basename(fname)):
+            os.remove(os.path.join(directory, old))
+
+    # The same name means the same content, keep the file and its compressed siblings
+    if not os.path.exists(fname):
+        with open(fname, "wb") as target:
+            target.write(data)
+    return new_url
+
+
+def compress(fname):
+    """ Write the .gz (and .br) siblings of the file unless they are up to date.
+    """
+    mtime = os.path.getmtime(fname)
+    variants = [(".gz", lambda data: gzip.compress(data, 9, mtime=0))]
+    if brotli is not None:
+        variants.append((".br", brotli.compress))
+
+    data = None
+    for suffix, compressor in variants:
+        if os.path.exists(fname + suffix) and os.path.getmtime(fname + suffix) >= mtime:
+            continue
+        if data is None:
+            with open(fname, "rb") as source:
+                data = source.read()
+        with open(fname + suffix, "wb") as target:
+            target.write(compressor(data))
+
+
+def compress_tree(directory):
+    """ Precompress all text files in the directory and its subdirectories.
+    """
+    for root, subdirs, files in os.walk(directory):
+        for fname in files:
+            if fname.endswith(COMPRESS_EXTENSIONS):
+                compress(os.path.join(root, fname))
+
+
+def make_dist(res_dir, build_dir, output_dir):
+    """ Fingerprint the scripts, stylesheets and sprite sheets, write urist.js
+    and index.html with the new references into the output directory and
+    precompress everything.
+
+    The files are read from the res and build directories and the sprites
+    from their original names in the output directory, so the stage can run
+    again after the output has been updated.
+    """
+    renames = {}
+    for fname in sorted(glob.glob(os.path.join(res_dir, "js", "*.js")) +
+                        glob.glob(os.path.join(res_dir, "css", "*.css"))):
+        url = "/" + os.path.relpath(fname, res_dir).replace(os.sep, "/")
+        with open(fname, "rb") as source:
+            renames[url] = write_fingerprinted(output_dir, url, source.read())
+
+    # The sprite sheets are made in the output directory, their stylesheets
+    # refer to the sheet images next to them
+    for fname in sorted(glob.glob(os.path.join(output_dir, "sprites", "*.css"))):
+        if fingerprint_re.match(os.path.basename(fname)):
+            continue
+        with open(fname, encoding="utf-8") as source:
+            style = source.read()
+        sheets = {}
+        sheet = os.path.splitext(fname)[0] + ".png"
+        if os.path.exists(sheet):
+            with open(sheet, "rb") as source:
+                new_url = write_fingerprinted(output_dir, "/sprites/" + os.path.basename(sheet), source.read())
+            sheets[os.path.basename(sheet)] = os.path.basename(new_url)
+        url = "/sprites/" + os.path.basename(fname)
+        renames[url] = write_fingerprinted(output_dir, url, rewrite(style, sheets).encode("utf-8"))
+
+    with open(os.path.join(build_dir, "js", "urist.js"), encoding="utf-8") as source:
+        uristjs = rewrite(source.read(), renames)
+    renames["/js/urist.js"] = write_fingerprinted(output_dir, "/js/urist.js", uristjs.encode("utf-8"))
+
+    with open(os.path.join(build_dir, "index.html"), encoding="utf-8") as source:
+        index = rewrite(source.read(), renames)
+    with open(os.path.join(output_dir, "index.html"), "w", encoding="utf-8") as target:
+        target.write(index)
+
+    compress_tree(output_dir)
+    return renames
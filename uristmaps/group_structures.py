@@ -1,10 +1,15 @@
-""" Read the structures.json and and form groups of same typed structures.
+""" Form groups of same typed structures and move the site markers onto them.
+
+The whole stage runs on the structure grid in memory: the groups are
+labelled, their bounding boxes and centers measured and the sites matched
+to the groups without any intermediate files.
 """
-import os, json, itertools, collections
+import os, json, collections
 
-from clint.textui import progress
+import numpy as np
 
 from uristmaps.config import conf
+from uristmaps import artifacts, components
 
 build_dir = conf["Paths"]["build"]
 
@@ -19,250 +24,163 @@ TYPE_TO_STRUCT = {
     "forest retreat" : "village",
 }
 
+# These structures should not be grouped (usually because there is no marker for them)
+BLACKLIST = ["river", "meadow", "crops", "orchard", "pasture"]
 
-def make_groups():
-    # load structures json into a map
-    with open(os.path.join(conf["Paths"]["build"], "structs.json")) as structjs:
-        structures = json.loads(structjs.read())
+# Site markers are moved onto groups up to this (manhattan) distance away
+SEARCH_RADIUS = 15
 
-    # Maps { x -> y -> group_index }
-    # Better would be {(x,y) -> group_index} but json cannot use tuples as keys!
-    groups = {}
+# Size of the buckets the group tiles are sorted into to find them by their location
+BUCKET_SIZE = 16
 
-    # Maps { group_index -> struct type}
-    group_defs = {}
 
-    next_grp_index = 0
+def group_sites():
+    """ Find the groups of structures, write them into groups.json and
+    move the markers in the sites.json to the center of their group.
+    """
+    grid, names = artifacts.load_grid("structs")
+    types, labels, count = make_groups(grid, names)
+    groups = measure_groups(types, labels, count)
 
-    world_size = structures["worldsize"]
+    with open(os.path.join(build_dir, "groups.json"), "w") as groupjs:
+        groupjs.write(json.dumps(groups))
 
-    # These structures should not be grouped (usually because there is no marker for them)
-    blacklist = ["river", "meadow", "crops", "orchard", "pasture"]
+    with open(os.path.join(build_dir, "sites.json")) as sitesjs:
+        # Contains the info about sites markers
+        sites = json.loads(sitesjs.read())
 
-    # first step is to grow groups on the map
-    for (x,y) in progress.dots(itertools.product(range(world_size), repeat=2), every=20000):
-        this_type = get_type(structures["map"], x, y)
+    center_group_sites(sites, groups, labels)
 
-        # Skip this tile when there's no structure
-        if this_type == "" or this_type in blacklist:
-            continue
+    with open(os.path.join(build_dir, "sites.json"), "w") as sitesjs:
+        sitesjs.write(json.dumps(sites))
 
-        current_grp = get_grp(groups, x, y)            
-        if current_grp == "":
-            current_grp = next_grp_index
-            group_defs[current_grp] = this_type
-            next_grp_index += 1
-            groups[x][y] = current_grp
-
-        allow_x = False
-        if x < world_size:
-            allow_x = True
-            right = get_type(structures["map"], x+1, y)
-            if right == this_type:
-                set_grp(groups, x+1, y, current_grp)
-
-        allow_y = False
-        if y < world_size:
-            allow_y = True
-            below = get_type(structures["map"], x, y+1)
-            if below == this_type:
-                set_grp(groups, x, y+1, current_grp)
-
-        if allow_x and allow_y:
-            right_below = get_type(structures["map"], x+1, y+1)
-            if right_below == this_type:
-                set_grp(groups, x+1, y+1, current_grp)
-
-        # for each tile, get the type of the one above and to the right
-        # to check if we have a new group here. write the grp index
-        # on these cells
-
-    # second step is to go over them and merge neighbouring groups
-    # of the same type
-    for (x,y) in progress.dots(itertools.product(range(world_size), repeat=2), every=20000):
-        this_grp = get_grp(groups, x, y)
-
-        # skip non-groups
-        if this_grp == "":
-            continue
 
-        allow_x = False
-        if x < world_size:
-            allow_x = True
-            right = get_grp(groups, x+1, y)
-            if right != "" and right != this_grp and \
-                group_defs[this_grp] == group_defs[right]:
-                replace_grp(groups, right, this_grp)
-                del(group_defs[right])
-
-        allow_y = False
-        if y < world_size:
-            allow_y = True
-            below = get_grp(groups, x, y+1)
-            if below != "" and below != this_grp and \
-                group_defs[this_grp] == group_defs[below]:
-                replace_grp(groups, below, this_grp)
-                del(group_defs[below])
-
-        if allow_x and allow_y:
-            right_below = get_grp(groups, x+1, y+1)
-            if right_below != "" and right_below != this_grp and \
-                group_defs[this_grp] == group_defs[right_below]:
-                replace_grp(groups, right_below, this_grp)
-                del(group_defs[right_below])
-
-    # Remove empty x-coordinates from the map
-    groups_final ={k:v for k,v in groups.items() if v}
-
-
-    result = {"groups": groups_final, "defs": group_defs}
-    with open(os.path.join(build_dir, "groups.json"), "w") as groupjs:
-        groupjs.write(json.dumps(result))
+def make_groups(grid, names):
+    """ Label the groups of structures in the structure grid.
 
+    Neighbouring tiles (right, below or right-below) with structures of the
+    same type form a group. The type is the name of the structure without
+    the neighbour suffixes.
 
-def center_groups():
-    """ Write a json that maps {groupId -> x,y} to mark the center
-    coordinate of that group.
+    Returns the tuple (types, labels, count): The type name of each group
+    (types[0] is unused), the grid of the group number (1..count) of each
+    tile with 0 for tiles without a group and the amount of groups.
     """
-    group_coords = collections.defaultdict(list)
-    with open(os.path.join(build_dir, "groups.json")) as groupjs:
-        groups = json.loads(groupjs.read())
-
-    for x in groups["groups"]:
-        for y in groups["groups"][x]:
-            group_coords[groups["groups"][x][y]].append((x,y))
-
-    # Maps group -> (left, top, right, bottom)
-    group_minmax = {}
-    for group in group_coords:
-        for (x,y) in group_coords[group]:
-            if group not in group_minmax:
-                group_minmax[group] = [int(x),int(y),int(x),int(y)]
-            else:
-                c = group_minmax[group]
-                group_minmax[group] = [min(int(x),c[0]), min(int(y), c[1]),
-                                       max(int(x),c[2]), max(int(y), c[3])]
-
-    group_centers = {}
-    for group in group_minmax:
-        c = group_minmax[group]
-        group_centers[group] = ((c[0] + c[2]) // 2,
-                                (c[1] + c[3]) // 2)
-
-    with open(os.path.join(build_dir, "group_centers.json"), "w") as sitesjs:
-        sitesjs.write(json.dumps(group_centers))
-
-def center_group_sites():
-    with open(os.path.join(build_dir, "sites.json")) as sitesjs:
-        # Contains the info about sites markers
-        sites = json.loads(sitesjs.read())
-    
-    with open(os.path.join(build_dir, "group_centers.json")) as centersjs:
-        # Maps group ids to centered coordinates
-        centers = json.loads(centersjs.read())
+    # Type index 0 means the tile is not grouped
+    type_names = [""]
+    type_of_name = np.zeros(len(names), dtype=np.uint16)
+    for index, name in enumerate(names):
+        struct_type = name.split("_")[0]
+        if struct_type == "" or struct_type in BLACKLIST:
+            continue
+        if struct_type not in type_names:
+            type_names.append(struct_type)
+        type_of_name[index] = type_names.index(struct_type)
+    type_grid = type_of_name[grid]
 
-    with open(os.path.join(build_dir, "groups.json")) as groupsjs:
-        # Contains info about groups (type)
-        group_info = json.loads(groupsjs.read())
+    labels, count = components.label_components(type_grid)
+
+    # All tiles of a group have the same type, take it from any of them
+    group_types = np.zeros(count + 1, dtype=np.uint16)
+    group_types[labels.ravel()] = type_grid.ravel()
+    types = [type_names[index] for index in group_types.tolist()]
+    return types, labels, count
 
-    # Iterate over all sites (skip those without structures)
-    # find the closest group that is not in the visited group set
-    # Move the site to the center coordinates
 
-    # Contains the IDs of groups that have received a marker
+def measure_groups(types, labels, count):
+    """ Determine the bounding box, center and size of every group.
+
+    The center is the middle of the bounding box, the centroid the mean
+    coordinate of the group's tiles.
+    Returns the list of group dicts with the group number - 1 as index.
+    """
+    ys, xs = np.nonzero(labels)
+    group_labels = labels[ys, xs].astype(np.intp)
+
+    sizes = np.bincount(group_labels, minlength=count + 1)
+    sum_x = np.bincount(group_labels, weights=xs, minlength=count + 1)
+    sum_y = np.bincount(group_labels, weights=ys, minlength=count + 1)
+
+    left = np.full(count + 1, labels.shape[1], dtype=np.intp)
+    top = np.full(count + 1, labels.shape[0], dtype=np.intp)
+    right = np.zeros(count + 1, dtype=np.intp)
+    bottom = np.zeros(count + 1, dtype=np.intp)
+    np.minimum.at(left, group_labels, xs)
+    np.minimum.at(top, group_labels, ys)
+    np.maximum.at(right, group_labels, xs)
+    np.maximum.at(bottom, group_labels, ys)
+
+    groups = []
+    for label in range(1, count + 1):
+        groups.append({"type": types[label],
+                       "bbox": [int(left[label]), int(top[label]), int(right[label]), int(bottom[label])],
+                       "center": [int(left[label] + right[label]) // 2, int(top[label] + bottom[label]) // 2],
+                       "centroid": [round(float(sum_x[label] / sizes[label]), 2),
+                                    round(float(sum_y[label] / sizes[label]), 2)],
+                       "size": int(sizes[label])})
+    return groups
+
+
+def center_group_sites(sites, groups, labels):
+    """ Move every site marker to the center of the closest group of a
+    matching type that has not received a marker yet.
+    """
+    # Sort the group tiles into buckets to quickly find the groups around a site
+    cell_index = index_group_cells(labels)
+
+    # Contains the indices of groups that have received a marker
     visited_groups = set()
 
+    # Iterate over all sites (skip those without structures)
     for site in sites:
         if site["type"] not in TYPE_TO_STRUCT:
-            #print("Skipping type: {}".format(site["type"]))
             continue
-        local_grps = []
-
-        radius = 0
-        site_moved = False
-        while True:
-            for group_id in find_groups(site["coords"], radius, group_info["groups"]):
-                group_id = str(group_id)
-                if group_id in visited_groups:
-                    continue
-                if group_info["defs"][group_id] not in TYPE_TO_STRUCT[site["type"]]:
-                    continue
-                # Move site marker and break loop
-                site["coords"] = centers[group_id]
-                site["coords_accurate"] = True
-                visited_groups.add(group_id)
-                site_moved = True
-                break
-
-            radius += 1
-            if radius >= 16 or site_moved:
-                #print("No group found for marker: {}".format(site))
-                break
-            
 
-    with open(os.path.join(build_dir, "sites.json"), "w") as sitesjs:
-        sitesjs.write(json.dumps(sites))
+        for group_id in find_groups(site["coords"], cell_index):
+            if group_id in visited_groups:
+                continue
+            if groups[group_id]["type"] not in TYPE_TO_STRUCT[site["type"]]:
+                continue
+            # Move site marker and break loop
+            site["coords"] = groups[group_id]["center"]
+            site["coords_accurate"] = True
+            visited_groups.add(group_id)
+            break
 
 
-def find_groups(coords, radius, groups):
-    """ Find the list of groups with the given radius around
-    the coords.
-    """
-    result = []
-    for x in range(radius):
-        try:
-            result.append(groups[str(coords[0]-x)][str(coords[1]-(radius-x))])
-        except:
-            pass
-        try:
-            result.append(groups[str(coords[0]-x)][str(coords[1]+(radius-x))])
-        except:
-            pass
-        try:
-            result.append(groups[str(coords[0]+x)][str(coords[1]+(radius-x))])
-        except:
-            pass
-        try:
-            result.append(groups[str(coords[0]+x)][str(coords[1]-(radius-x))])
-        except:
-            pass
-    #print("Found {} groups.".format(len(result)))
-    return result
-
-
-def replace_grp(groups, old, new):
-    """ Replace all instances of old-grp index with the new one
-    in the group-map groups.
-    """
-    for x in groups:
-        for y in groups[x]:
-            if groups[x][y] == old:
-                groups[x][y] = new
-
-
-def set_grp(groups, x, y, group_index):
-    if x not in groups:
-        groups[x] = {}
-    groups[x][y] = group_index
-
-        
-def get_grp(groups, x, y):
-    if x not in groups:
-        groups[x] = {}
-        return ""
-    if y not in groups[x]:
-        return ""
-    return groups[x][y]
-
-
-def get_type(structs, x, y):
-    """ Determine the type of the structure at the given coordinates.
-    When there is no structure the result is ""
+def index_group_cells(labels):
+    """ Sort the tiles of the groups into square buckets of BUCKET_SIZE tiles.
+
+    Returns the dict { (bucket_x, bucket_y) -> [(x, y, group_index)] }.
     """
-    try:
-        typ = structs[str(x)][str(y)].split("_")[0]
-        return typ
-    except Exception as e:
-        return ""
+    index = collections.defaultdict(list)
+    ys, xs = np.nonzero(labels)
+    for x, y, label in zip(xs.tolist(), ys.tolist(), labels[ys, xs].tolist()):
+        index[(x // BUCKET_SIZE, y // BUCKET_SIZE)].append((x, y, label - 1))
+    return index
 
 
+def find_groups(coords, cell_index):
+    """ Find the list of groups around the coords ordered by their distance.
+
+    Searches the tiles in rings of growing (manhattan) radius up to
+    SEARCH_RADIUS. Within a ring the tiles are ordered by their horizontal
+    distance, then by the quadrant (left-above, left-below, right-below,
+    right-above). Tiles in the same row as the coords are skipped.
+    """
+    cx, cy = coords
+    first_x, last_x = (cx - SEARCH_RADIUS) // BUCKET_SIZE, (cx + SEARCH_RADIUS) // BUCKET_SIZE
+    first_y, last_y = (cy - SEARCH_RADIUS) // BUCKET_SIZE, (cy + SEARCH_RADIUS) // BUCKET_SIZE
+
+    found = []
+    for bucket_x in range(first_x, last_x + 1):
+        for bucket_y in range(first_y, last_y + 1):
+            for (x, y, group_id) in cell_index.get((bucket_x, bucket_y), ()):
+                dx, dy = x - cx, y - cy
+                radius = abs(dx) + abs(dy)
+                if dy == 0 or radius > SEARCH_RADIUS:
+                    continue
+                quadrant = (0 if dy < 0 else 1) if dx <= 0 else (2 if dy > 0 else 3)
+                found.append((radius, abs(dx), quadrant, group_id))
+
+    return [group_id for (radius, dist_x, quadrant, group_id) in sorted(found)]
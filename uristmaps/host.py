@@ -0,0 +1,345 @@
+""" A small web server hosting the contents of the output directory.
+
+Optionally renders the map tiles when they are requested for the first time
+instead of requiring all tiles to be rendered up front.
+
+Also answers queries for the details and history of a site from the legends
+database: /api/site/{id} returns them as json.
+
+Each request is handled in its own thread. The map tiles and images are sent
+with a Cache-Control header that lets the browser keep them for max_age
+seconds, the files with a content hash in their name (see uristmaps.dist)
+for a year. All responses carry an ETag to answer repeated requests with
+304 Not Modified. When a file has a precompressed .br or .gz sibling, that
+is sent instead to the browsers that accept the encoding.
+"""
+import os, re, json, hashlib, threading, collections, email.utils
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+from uristmaps.config import conf
+from uristmaps import render_sat_layer, load_legends, legendsdb, dist
+
+output_dir = conf.get("Paths", "output")
+
+# Matches the requests of the map tiles: /tiles/{z}/{x}/{y}.png (or .webp)
+tile_re = re.compile(r"^/tiles/(\d+)/(\d+)/(\d+)\.(png|webp)$")
+
+# Matches the requests of the site details: /api/site/{id}
+site_re = re.compile(r"^/api/site/(\d+)$")
+
+# Requests of these files are cached by the browser for max_age seconds
+long_cache_re = re.compile(r"^/(tiles|icons|sites)/")
+
+# The precompressed variants of a file in the order they are preferred and
+# the suffix of their files
+ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+
+
+def accepted_encodings(header):
+    """ Read the content encodings from the value of an Accept-Encoding header,
+    leaving out the ones refused with q=0.
+    """
+    encodings = set()
+    for entry in (header or "").split(","):
+        name, *params = entry.split(";")
+        quality = 1.0
+        for param in params:
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name.strip() and quality > 0:
+            encodings.add(name.strip().lower())
+    return encodings
+
+
+class TileCache:
+    """ Keeps the most recently used encoded tiles in memory.
+    Drops the least recently used tile when more than size tiles are stored.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.tiles = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.tiles:
+                return None
+            self.tiles.move_to_end(key)
+            return self.tiles[key]
+
+    def put(self, key, data):
+        with self.lock:
+            self.tiles[key] = data
+            self.tiles.move_to_end(key)
+            while len(self.tiles) > self.size:
+                self.tiles.popitem(last=False)
+
+
+class UristRequestHandler(SimpleHTTPRequestHandler):
+    """ Serves the files of the output directory.
+
+    Tile requests are answered from the tile store when the tiles are not
+    plain files or when missing tiles are rendered on demand.
+    """
+
+    # The store to write the tiles rendered on demand into or None when the
+    # tiles are served as files. The tiles are read through the read_store
+    # of each thread.
+    tile_store = None
+
+    # The read-only tile stores of the request threads
+    read_stores = threading.local()
+
+    # Renders missing tiles on request, None when rendering on demand is disabled
+    renderer = None
+
+    # Store the tiles rendered on demand in the tile store
+    disk_cache = False
+
+    # In-memory cache of the tiles read from the store or rendered on demand
+    tile_cache = None
+
+    # Only one tile is rendered and written at a time
+    render_lock = threading.Lock()
+
+    max_zoom = 0
+
+    # Path of the legends database or None when there is none
+    legends_db = None
+
+    # Seconds the browser may keep the tiles and images
+    max_age = 0
+
+    # Keep the connections open for the many requests of the tiles
+    protocol_version = "HTTP/1.1"
+
+    extensions_map = dict(SimpleHTTPRequestHandler.extensions_map, **{".webp": "image/webp"})
+
+    def do_GET(self):
+        match = site_re.match(self.path.split("?")[0])
+        if match:
+            self.send_site(int(match.group(1)))
+            return
+
+        match = tile_re.match(self.path.split("?")[0])
+        if match and self.tile_store is not None and match.group(4) == render_sat_layer.tile_extension():
+            self.send_tile(*[int(group) for group in match.groups()[:3]])
+            return
+        super().do_GET()
+
+    def send_tile(self, level, tile_x, tile_y):
+        data = self.load_tile(level, tile_x, tile_y)
+        if data is None:
+            self.send_error(404, "Tile not found")
+            return
+        etag = '"{}"'.format(hashlib.sha1(data).hexdigest()[:20])
+        if self.not_modified(etag):
+            self.send_response(304)
+            self.send_cache_headers(etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "image/{}".format(render_sat_layer.tile_extension()))
+        self.send_header("Content-Length", str(len(data)))
+        self.send_cache_headers(etag)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_site(self, site_id):
+        if self.legends_db is None:
+            self.send_error(404, "No legends database")
+            return
+
+        # The connection is opened for each request, sqlite connections can
+        # not be shared between threads.
+        connection = legendsdb.open_db(self.legends_db)
+        try:
+            site = legendsdb.site_info(connection, site_id)
+        finally:
+            connection.close()
+        if site is None:
+            self.send_error(404, "Site not found")
+            return
+
+        data = json.dumps(site).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_head(self):
+        """ Send the headers for the requested file and return the opened file
+        to send or None when there is nothing more to send.
+
+        Only files are handled here, directory listings and errors are left to
+        SimpleHTTPRequestHandler.
+        """
+        path = self.translate_path(self.path)
+        if os.path.isdir(path) and self.path.split("?")[0].endswith("/"):
+            path = os.path.join(path, "index.html")
+        if not os.path.isfile(path):
+            return super().send_head()
+
+        fname, encoding, variants = self.pick_variant(path)
+        try:
+            source = open(fname, "rb")
+        except OSError:
+            self.send_error(404, "File not found")
+            return None
+
+        stat = os.fstat(source.fileno())
+        etag = '"{:x}-{:x}"'.format(stat.st_mtime_ns, stat.st_size)
+        if self.not_modified(etag, stat.st_mtime):
+            source.close()
+            self.send_response(304)
+            self.send_cache_headers(etag, variants)
+            self.end_headers()
+            return None
+
+        self.send_response(200)
+        self.send_header("Content-Type", self.guess_type(path))
+        self.send_header("Content-Length", str(stat.st_size))
+        self.send_header("Last-Modified", self.date_time_string(stat.st_mtime))
+        if encoding is not None:
+            self.send_header("Content-Encoding", encoding)
+        self.send_cache_headers(etag, variants)
+        self.end_headers()
+        return source
+
+    def pick_variant(self, path):
+        """ Find the file to send for the path, the precompressed version
+        when there is one that the browser accepts. Compressed files that are
+        older than the file itself are left out, they belong to an old version.
+
+        Returns (file name, content encoding, has compressed variants).
+        """
+        accepted = accepted_encodings(self.headers.get("Accept-Encoding"))
+        mtime = os.path.getmtime(path)
+        variants = False
+        for encoding, suffix in ENCODINGS:
+            if os.path.isfile(path + suffix) and os.path.getmtime(path + suffix) >= mtime:
+                variants = True
+                if encoding in accepted:
+                    return path + suffix, encoding, True
+        return path, None, variants
+
+    def not_modified(self, etag, mtime=None):
+        """ Check if the browser already has the current version of the response.
+        """
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None:
+            return etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*"
+
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since is not None and mtime is not None:
+            try:
+                since = email.utils.parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError, IndexError, OverflowError):
+                return False
+            return since.timestamp() >= int(mtime)
+        return False
+
+    def send_cache_headers(self, etag, variants=False):
+        self.send_header("ETag", etag)
+        path = self.path.split("?")[0]
+        if dist.fingerprint_re.match(os.path.basename(path)):
+            # The name changes with the content
+            self.send_header("Cache-Control", "public, max-age=31536000, immutable")
+        elif long_cache_re.match(path):
+            self.send_header("Cache-Control", "public, max-age={}".format(self.max_age))
+        else:
+            self.send_header("Cache-Control", "no-cache")
+        if variants:
+            self.send_header("Vary", "Accept-Encoding")
+
+    def copyfile(self, source, outputfile):
+        """ Send the files with sendfile instead of copying them through
+        python, falls back to copying where that is not possible.
+        """
+        if outputfile is self.wfile:
+            self.connection.sendfile(source)
+        else:
+            super().copyfile(source, outputfile)
+
+    def load_tile(self, level, tile_x, tile_y):
+        """ Get the encoded tile from the memory cache, the tile store or
+        render it. Returns None when there is no such tile.
+        """
+        if level > self.max_zoom or not (0 <= tile_x < 2 ** level and 0 <= tile_y < 2 ** level):
+            return None
+
+        key = (level, tile_x, tile_y)
+        data = self.tile_cache.get(key)
+        if data is not None:
+            return data
+
+        data = self.read_store().get(level, tile_x, tile_y)
+        if data is None and self.renderer is not None:
+            # The renderer and the writing store are shared by all request
+            # threads. Another thread might have rendered the tile while
+            # this one was waiting.
+            with self.render_lock:
+                data = self.tile_cache.get(key)
+                if data is None and self.disk_cache:
+                    data = self.tile_store.get(level, tile_x, tile_y)
+                if data is None:
+                    image = self.renderer.render(level, tile_x, tile_y)
+                    if image is None:
+                        return None
+                    data = self.renderer.encoder.encode(image)
+                    if self.disk_cache:
+                        self.tile_store.put(level, tile_x, tile_y, data)
+                        self.tile_store.flush()
+
+        if data is not None:
+            self.tile_cache.put(key, data)
+        return data
+
+    def read_store(self):
+        """ The tile store of this thread to read the tiles from. sqlite
+        connections can not be shared between threads.
+        """
+        store = getattr(self.read_stores, "store", None)
+        if store is None:
+            store = self.read_stores.store = render_sat_layer.open_tile_store(readonly=True)
+        return store
+
+
+def serve():
+    """ Start the server and keep it running until it is interrupted.
+    """
+    port = conf.getint("Host", "port", fallback=8000)
+
+    on_demand = conf.getboolean("Host", "render_on_demand", fallback=False)
+    if on_demand or conf.get("Output", "tile_backend", fallback="files") == "mbtiles":
+        UristRequestHandler.tile_store = render_sat_layer.open_tile_store()
+        UristRequestHandler.tile_cache = TileCache(conf.getint("Host", "cache_size", fallback=4096))
+        UristRequestHandler.max_zoom = conf.getint("Map", "max_zoom")
+    if on_demand:
+        print("Loading the world to render tiles on demand.")
+        UristRequestHandler.renderer = render_sat_layer.TileRenderer()
+        UristRequestHandler.disk_cache = conf.getboolean("Host", "disk_cache", fallback=True)
+
+    UristRequestHandler.max_age = conf.getint("Host", "max_age", fallback=604800)
+
+    if os.path.exists(load_legends.legends_db_file()):
+        UristRequestHandler.legends_db = load_legends.legends_db_file()
+
+    handler = partial(UristRequestHandler, directory=output_dir)
+    server = ThreadingHTTPServer(("", port), handler)
+    server.daemon_threads = True
+    print("Serving {} on port {}".format(output_dir, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,139 @@
+""" Streaming reader for the legends.xml export.
+
+The legends can be several gigabytes big, so the file is never loaded as a
+whole. The sections that are not needed are skipped by searching the raw
+bytes for the start tag of the next wanted section. The wanted sections are
+fed chunk by chunk into an incremental XML parser that hands out each entry
+of the section as soon as it is complete and forgets it afterwards.
+"""
+import re
+import xml.etree.ElementTree as ET
+
+# Amount of bytes read from the file at once
+CHUNK_SIZE = 1 << 20
+
+# Control characters are not allowed in XML but show up in the exported names
+INVALID_CHARS = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+def iter_sections(fname, sections, chunk_size=CHUNK_SIZE):
+    """ Read the entries of the given top level sections of the legends file.
+
+    The sections have to be given in the order they appear in the file,
+    sections that do not exist are skipped.
+    Yields (section, element) for every entry of the sections. The element
+    is only valid until the next entry is read.
+    """
+    with open(fname, "rb") as xmlfile:
+        buffer = b""
+        for section in sections:
+            position = xmlfile.tell() - len(buffer)
+            rest = find_tag(xmlfile, buffer, "<{}>".format(section).encode(), chunk_size)
+            if rest is None:
+                # Missing section, search the next one from the same place
+                xmlfile.seek(position)
+                buffer = b""
+                continue
+
+            buffer = yield from parse_section(xmlfile, rest, section, chunk_size)
+
+
+def find_tag(xmlfile, buffer, tag, chunk_size):
+    """ Skip the file contents up to and including the tag.
+
+    Returns the rest of the read data after the tag or None when the file
+    ended before the tag was found.
+    """
+    while True:
+        index = buffer.find(tag)
+        if index >= 0:
+            return buffer[index + len(tag):]
+
+        chunk = xmlfile.read(chunk_size)
+        if not chunk:
+            return None
+        # Keep the end of the old data, the tag might be split between the chunks
+        buffer = buffer[-(len(tag) - 1):] + chunk
+
+
+def parse_section(xmlfile, buffer, section, chunk_size):
+    """ Parse the section that starts with the data in buffer and yield its entries.
+
+    Returns the data that was read after the end of the section.
+    """
+    end_tag = "</{}>".format(section).encode()
+    parser = ET.XMLPullParser(events=("start", "end"))
+    parser.feed("<{}>".format(section))
+    root = None
+    depth = 0
+
+    while True:
+        index = buffer.find(end_tag)
+        if index >= 0:
+            data, buffer = buffer[:index] + end_tag, buffer[index + len(end_tag):]
+        else:
+            # The end tag might be split between this and the next chunk
+            keep = len(end_tag) - 1
+            data, buffer = buffer[:-keep], buffer[-keep:]
+
+        parser.feed(INVALID_CHARS.sub("", data.decode("iso-8859-1")))
+        for event, element in parser.read_events():
+            if event == "start":
+                depth += 1
+                if root is None:
+                    root = element
+                continue
+            depth -= 1
+            if depth == 1:
+                yield section, element
+                root.clear()
+
+        if index >= 0:
+            parser.close()
+            return buffer
+
+        chunk = xmlfile.read(chunk_size)
+        if not chunk:
+            raise ValueError("The legends file ended within the <{}> section".format(section))
+        buffer += chunk
+
+
+def read_site(element):
+    """ Extract the information of a <site> entry.
+
+    The coords are the rough world coordinates as (x, y) tuple.
+    """
+    x, y = element.findtext("coords", "0,0").split(",")
+    site = {"id": element.findtext("id"),
+            "type": element.findtext("type"),
+            "name": element.findtext("name"),
+            "coords": (int(x), int(y))}
+
+    structures = [{"type": structure.findtext("type"), "name": structure.findtext("name")}
+                  for structure in element.iter("structure")]
+    if structures:
+        site["structures"] = structures
+    return site
+
+
+# The historical events that change the owner of a site and the field of the new owner.
+# None means the site has no owner afterwards.
+OWNER_EVENTS = {
+    "created site"     : "civ_id",
+    "reclaim site"     : "civ_id",
+    "site taken over"  : "attacker_civ_id",
+    "destroyed site"   : None,
+}
+
+
+def read_owner_change(element):
+    """ Check if the <historical_event> changes the owner of a site.
+
+    Returns the tuple (site_id, civ_id) with civ_id None when the site is
+    left without an owner. Returns None for all other events.
+    """
+    event_type = element.findtext("type")
+    if event_type not in OWNER_EVENTS or element.findtext("site_id") is None:
+        return None
+    civ_field = OWNER_EVENTS[event_type]
+    return element.findtext("site_id"), civ_field and element.findtext(civ_field)
@@ -0,0 +1,203 @@
+""" Index the legends.xml in an SQLite database.
+
+The legends are streamed into the database once. Afterwards the history of
+a site, figure or civilization can be looked up through the indexes instead
+of scanning the whole export again.
+
+Every event is linked to the sites, historical figures and entities it
+mentions in the event_links table, for example the event of a figure
+founding a site gets a ("site", site_id) and a ("hf", hfid) link.
+"""
+import os, json, sqlite3
+
+from uristmaps import legends
+
+SCHEMA = """
+    CREATE TABLE sites (id INTEGER PRIMARY KEY, type TEXT, name TEXT, x INTEGER, y INTEGER);
+    CREATE TABLE structures (site_id INTEGER, local_id INTEGER, type TEXT, name TEXT);
+    CREATE TABLE historical_figures (id INTEGER PRIMARY KEY, name TEXT, race TEXT, caste TEXT,
+                                     birth_year INTEGER, death_year INTEGER, data TEXT);
+    CREATE TABLE entities (id INTEGER PRIMARY KEY, name TEXT);
+    CREATE TABLE historical_events (id INTEGER PRIMARY KEY, year INTEGER, seconds72 INTEGER,
+                                    type TEXT, data TEXT);
+    CREATE TABLE event_links (event_id INTEGER, kind TEXT, ref_id INTEGER);
+"""
+
+# The indexes are created after all rows have been inserted, that is a lot faster
+INDEXES = """
+    CREATE INDEX structures_site ON structures (site_id);
+    CREATE INDEX historical_events_type ON historical_events (type);
+    CREATE INDEX event_links_ref ON event_links (kind, ref_id);
+    CREATE INDEX event_links_event ON event_links (event_id);
+"""
+
+# The sections of the legends that are stored, in the order of the file
+SECTIONS = ["sites", "historical_figures", "entities", "historical_events"]
+
+# Amount of rows inserted at once
+BATCH_SIZE = 10000
+
+
+def ingest(fname, db_file):
+    """ Read the legends file into a new database at db_file.
+
+    The database is written to a temporary file first and only replaces
+    the old one when it is complete.
+    """
+    tmp_file = db_file + ".tmp"
+    if os.path.exists(tmp_file):
+        os.remove(tmp_file)
+
+    connection = sqlite3.connect(tmp_file)
+    connection.execute("PRAGMA journal_mode=OFF")
+    connection.execute("PRAGMA synchronous=OFF")
+    connection.executescript(SCHEMA)
+
+    inserts = {
+        "sites": "INSERT OR REPLACE INTO sites VALUES (?, ?, ?, ?, ?)",
+        "structures": "INSERT INTO structures VALUES (?, ?, ?, ?)",
+        "historical_figures": "INSERT OR REPLACE INTO historical_figures VALUES (?, ?, ?, ?, ?, ?, ?)",
+        "entities": "INSERT OR REPLACE INTO entities VALUES (?, ?)",
+        "historical_events": "INSERT OR REPLACE INTO historical_events VALUES (?, ?, ?, ?, ?)",
+        "event_links": "INSERT INTO event_links VALUES (?, ?, ?)",
+    }
+    rows = {table: [] for table in inserts}
+
+    for section, element in legends.iter_sections(fname, SECTIONS):
+        if section == "sites":
+            site = legends.read_site(element)
+            rows["sites"].append((int(site["id"]), site["type"], site["name"]) + site["coords"])
+            for structure in element.iter("structure"):
+                rows["structures"].append((int(site["id"]), to_int(structure.findtext("id")),
+                                           structure.findtext("type"), structure.findtext("name")))
+        elif section == "historical_figures":
+            fields = element_fields(element)
+            rows["historical_figures"].append((int(fields.pop("id")), fields.pop("name", None),
+                                               fields.pop("race", None), fields.pop("caste", None),
+                                               to_int(fields.pop("birth_year", None)),
+                                               to_int(fields.pop("death_year", None)),
+                                               json.dumps(fields)))
+        elif section == "entities":
+            rows["entities"].append((int(element.findtext("id")), element.findtext("name")))
+        else:
+            fields = element_fields(element)
+            event_id = int(fields.pop("id"))
+            rows["historical_events"].append((event_id, to_int(fields.pop("year", None)),
+                                              to_int(fields.pop("seconds72", None)),
+                                              fields.pop("type", None), json.dumps(fields)))
+            rows["event_links"].extend((event_id, kind, ref_id) for kind, ref_id in event_links(fields))
+
+        if len(rows[section]) >= BATCH_SIZE or len(rows["event_links"]) >= BATCH_SIZE:
+            write_rows(connection, inserts, rows)
+
+    write_rows(connection, inserts, rows)
+    connection.executescript(INDEXES)
+    connection.commit()
+    connection.close()
+    os.replace(tmp_file, db_file)
+
+
+def write_rows(connection, inserts, rows):
+    with connection:
+        for table, table_rows in rows.items():
+            if table_rows:
+                connection.executemany(inserts[table], table_rows)
+                table_rows.clear()
+
+
+def element_fields(element):
+    """ Collect the text of the simple child elements into a dict.
+    Fields that occur more than once become lists.
+    """
+    fields = {}
+    for child in element:
+        if len(child):
+            continue
+        value = child.text or ""
+        if child.tag not in fields:
+            fields[child.tag] = value
+        elif isinstance(fields[child.tag], list):
+            fields[child.tag].append(value)
+        else:
+            fields[child.tag] = [fields[child.tag], value]
+    return fields
+
+
+def event_links(fields):
+    """ Find the sites, historical figures and entities the event fields refer to.
+    Yields (kind, id) with kind being "site", "hf" or "entity".
+    """
+    for name, values in fields.items():
+        if name.endswith("site_id"):
+            kind = "site"
+        elif "hfid" in name or name.endswith("hist_figure_id"):
+            kind = "hf"
+        elif name.endswith("civ_id") or name.endswith("entity_id"):
+            kind = "entity"
+        else:
+            continue
+        for value in (values if isinstance(values, list) else [values]):
+            ref_id = to_int(value)
+            # -1 is used when there is nothing to refer to
+            if ref_id is not None and ref_id >= 0:
+                yield kind, ref_id
+
+
+def to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def open_db(db_file):
+    """ Open the database for reading.
+    """
+    connection = sqlite3.connect("file:{}?mode=ro".format(db_file), uri=True, check_same_thread=False)
+    connection.row_factory = sqlite3.Row
+    return connection
+
+
+def site_history(connection, site_id, limit=None):
+    """ List the events that happened at the site, the oldest first.
+
+    With a limit only the most recent events are returned.
+    Each event is a dict with its year, type and the names of the
+    historical figures involved.
+    """
+    query = """SELECT e.id, e.year, e.type FROM event_links AS l
+               JOIN historical_events AS e ON e.id = l.event_id
+               WHERE l.kind = 'site' AND l.ref_id = ?
+               ORDER BY e.year DESC, e.seconds72 DESC, e.id DESC"""
+    params = [int(site_id)]
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+    events = [{"id": row["id"], "year": row["year"], "type": row["type"], "figures": []}
+              for row in connection.execute(query, params)]
+    events.reverse()
+
+    by_id = {event["id"]: event for event in events}
+    for start in range(0, len(events), 500):
+        ids = [event["id"] for event in events[start:start + 500]]
+        rows = connection.execute(
+            """SELECT l.event_id, hf.name FROM event_links AS l
+               JOIN historical_figures AS hf ON hf.id = l.ref_id
+               WHERE l.kind = 'hf' AND l.event_id IN ({})""".format(",".join("?" * len(ids))), ids)
+        for row in rows:
+            if row["name"]:
+                by_id[row["event_id"]]["figures"].append(row["name"])
+    return events
+
+
+def site_info(connection, site_id, history_limit=None):
+    """ Gather everything known about the site. Returns None for unknown sites.
+    """
+    row = connection.execute("SELECT * FROM sites WHERE id = ?", (int(site_id),)).fetchone()
+    if row is None:
+        return None
+    site = dict(row)
+    site["structures"] = [dict(structure) for structure in connection.execute(
+        "SELECT local_id, type, name FROM structures WHERE site_id = ? ORDER BY local_id", (int(site_id),))]
+    site["history"] = site_history(connection, site_id, history_limit)
+    return site
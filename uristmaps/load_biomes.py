@@ -1,14 +1,11 @@
-import json, os, logging
+import logging
 
-from PIL import Image
-
-from uristmaps.config import conf
+from uristmaps import artifacts, bmpdecode, world
 from uristmaps.filefinder import biome_map
 
 def load():
-    orig = Image.open(biome_map())
-    logging.debug("Loaded world sized {0}x{0}".format(orig.size[0]))
-    pixels = orig.load()
+    orig = bmpdecode.read_rgb(biome_map())
+    logging.debug("Loaded world sized {0}x{0}".format(orig.shape[1]))
 
     BIOMES = {
         (128,128,128): "mountain",
@@ -49,19 +46,17 @@ def load():
         (255,128,64): "rock_desert",
     }
 
-    biomes = []
-    for y in range(orig.size[1]):
-        row = []
-        for x in range(orig.size[0]):
-            row.append(BIOMES[pixels[(x,y)]])
-        biomes.append(row)
+    # The grid stores the index of each biome in the sorted list of names
+    names = sorted(set(BIOMES.values()))
+    index = {color: names.index(name) for color, name in BIOMES.items()}
+
+    biomes, unknown = bmpdecode.decode(orig, index, default=len(names))
 
-    result = {"worldsize": orig.size[0],
-              "map": biomes}
-    build_dir = conf["Paths"]["build"]
-    if not os.path.exists(build_dir):
-        os.makedirs(build_dir)
-    with open("{}/biomes.json".format(build_dir), "w") as heightjson:
-        heightjson.write(json.dumps(result))
-        logging.debug("Dumped biomes into {}/biomes.json".format(build_dir))
+    # The unknown colors are rendered as tiles without an image
+    if unknown:
+        bmpdecode.report_unknown(unknown, "biome map")
+        names.append("unknown")
 
+    artifacts.save_grid("biomes", biomes, names)
+    world.write_manifest(biomes.shape[1], {"bm": biome_map()})
+    logging.debug("Dumped biomes into {}".format(artifacts.grid_file("biomes")))
@@ -1,28 +1,19 @@
-import json
+import logging
 
-from PIL import Image
+import numpy as np
 
-orig = Image.open("maps/world_graphic-el-region5-250--10081.bmp")
-pixels = orig.load()
-print("Found elevation map @{}x{}".format(orig.size[0], orig.size[1]))
+from uristmaps import filefinder, artifacts, bmpdecode
 
-print("Generating heightmap.")
-heightmap = []
-for y in range(orig.size[1]):
-    row = []
-    for x in range(orig.size[0]):
-        row.append(pixels[(x,y)][2])
-        # When r=g=b then the image is gray and means land.
-        if pixels[(x,y)][0] == pixels[(x,y)][1] == pixels[(x,y)][2]:
-            pass
-        else:
-            #print(pixels[(x,y)])
-            pass
-    heightmap.append(row)
 
-result = {"width": orig.size[0], "height": orig.size[1],
-          "map": heightmap}
-with open("build/heightmap.json", "w") as heightjson:
-    heightjson.write(json.dumps(result))
-    print("Dumped heightmap into build/heightmap.json")
+def load():
+    """ Read the elevation map and write the heightmap grid.
 
+    The elevation is encoded in the blue channel. Where r=g=b the
+    image is gray and means land.
+    """
+    orig = bmpdecode.read_rgb(filefinder.load_map("el"))
+    logging.debug("Found elevation map @{}x{}".format(orig.shape[1], orig.shape[0]))
+
+    heightmap = np.ascontiguousarray(orig[..., 2])
+    np.save(artifacts.grid_file("heightmap"), heightmap)
+    logging.debug("Dumped heightmap into {}".format(artifacts.grid_file("heightmap")))
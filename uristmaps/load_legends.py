@@ -1,14 +1,19 @@
-import json, os, math, logging, re
+import json, os, logging, re, shutil, collections
+
+import numpy as np
 
 from clint.textui import progress
 
 from PIL import Image
 
 from uristmaps.config import conf
-from uristmaps import filefinder
+from uristmaps import filefinder, legends, legendsdb, markers, search, world
 
 df_tilesize = 16
 
+# Amount of consecutive site ids whose details are stored in one file
+SITE_SHARD_SIZE = 100
+
 # Offset of the world within the rendered map area.
 offset = None
 
@@ -23,47 +28,35 @@ build_dir = conf.get("Paths", "build")
 def calc_globals():
     global offset
     global zoom
-    with open(os.path.join(build_dir, "biomes.json")) as biomjs:
-        biomes = json.loads(biomjs.read())
-    worldsize = biomes["worldsize"]
-
-    zoom = 0
-    while 2 ** zoom < worldsize:
-        zoom += 1
-
-    mapsize = 2**zoom
-    offset = (mapsize - worldsize) // 2
+    manifest = world.load_manifest()
+    zoom = manifest["zoom"]
+    offset = manifest["offset"]
 
 
 def load_sites():
     """ Load the site information.
     """
-    global offset
-    global zoom
-
-    if offset is None:
-        calc_globals()
-
     fname = filefinder.legends_xml()
     logging.debug("Reading legends xml ({} Mb)".format(os.path.getsize(fname) // 1024 // 1024))
 
     sites = []
-    sites_started = False
-    with open(fname, "r", encoding="iso-8859-1") as xmlfile:
-        for line in progress.dots(xmlfile, every=1000):
-            if not sites_started:
-                if line.startswith("<sites>"):
-                    sites_started = True
-                continue
-            try:
-                if not add_to_sites(sites, line.strip()):
-                    break
-            except Exception as e:
-                print(e)
-                print("Line: '{}'".format(line))
-                break
-
-    print() # A very nice linebreak after all the dots generated by the loop
+    civ_names = {}
+    site_owners = {}
+    for section, element in legends.iter_sections(fname, ["sites", "entities", "historical_events"]):
+        if section == "sites":
+            site = legends.read_site(element)
+            site["coords"] = deflate_coords(*site["coords"])
+            site["coords_accurate"] = False
+            sites.append(site)
+        elif section == "entities":
+            civ_names[element.findtext("id")] = element.findtext("name")
+        else:
+            # Follow the events to find the current owner of each site
+            change = legends.read_owner_change(element)
+            if change:
+                site_owners[change[0]] = change[1]
+
+    logging.debug("Read {} sites from the legends".format(len(sites)))
 
     # iterate over the sites and do some filtering
     show_vaults = conf.getboolean("Map", "show_spoilers", fallback=True)
@@ -71,46 +64,27 @@ def load_sites():
     for site in sites:
         if site["type"] == "vault" and not show_vaults:
             continue
+        civ_id = site_owners.get(site["id"])
+        if civ_id is not None:
+            site["civ_id"] = civ_id
+            if civ_names.get(civ_id):
+                site["civ"] = civ_names[civ_id]
         result.append(site)
 
+    os.makedirs(build_dir, exist_ok=True)
     with open(os.path.join(build_dir, "sites.json"), "w") as sitesjson:
         sitesjson.write(json.dumps(result))
 
 
-def add_to_sites(sites, line):
-    """ Parse the current line add the information to the sites list.
-    Return true when the line was handled, return false when the
-    sites-block is over.
+def ingest_legends():
+    """ Stream the legends.xml into the legends database.
     """
-    if line == "<site>":
-        sites.append({})
-        return True
-    if line == "</site>":
-        return True
-    if line == "</sites>":
-        return False
-
-    #<structures> are not yet handled
-    if "structures" in line:
-        return True
-
-    start = line.index(">")
-    end = line.index("<", start)
-    start += 1
-    if line.startswith("<id>"):
-        sites[-1]["id"] = line[start:end]
-        return True
-    if line.startswith("<type>"):
-        sites[-1]["type"] = line[start:end]
-        return True
-    if line.startswith("<name>"):
-        sites[-1]["name"] = line[start:end]
-        return True
-    if line.startswith("<coords>"):
-        sites[-1]["coords"] = deflate_coords(*line[start:end].split(","))
-        sites[-1]["coords_accurate"] = False
-        return True
-    return False
+    os.makedirs(build_dir, exist_ok=True)
+    legendsdb.ingest(filefinder.legends_xml(), legends_db_file())
+
+
+def legends_db_file():
+    return os.path.join(build_dir, "legends.sqlite")
 
 
 def deflate_coords(x,y):
@@ -120,9 +94,11 @@ def deflate_coords(x,y):
     return int(x) * df_tilesize + df_tilesize // 2, int(y) * df_tilesize + df_tilesize // 2
 
 
-def xy2lonlat(xtile, ytile):
-    """ Transform the world coordinate into lat-lon coordinates that can
+def xy2lonlat(coords):
+    """ Transform the world coordinates into lat-lon coordinates that can
     be used as GeoJSON.
+
+    coords is a list of (x, y) coordinates. Returns the list of (lon, lat).
     """
     global offset
     global zoom
@@ -131,20 +107,34 @@ def xy2lonlat(xtile, ytile):
         calc_globals()
 
     # Move the coordinates by the offset along to get them into the centered world render
-    xtile = int(xtile) + offset
-    ytile = int(ytile) + offset
+    tiles = np.array(coords, dtype=np.float64).reshape(-1, 2) + offset
 
     # latlon magic from osm ( http://wiki.openstreetmap.org/wiki/Slippy_map_tilenames#Tile_numbers_to_lon..2Flat._2 )
     n = 2.0 ** zoom
-    lon_deg = xtile / n * 360.0 - 180.0
-    lat_rad = math.atan(math.sinh(math.pi * (1 - 2 * ytile / n)))
-    lat_deg = math.degrees(lat_rad)
-    return (lon_deg, lat_deg)
+    lon_deg = tiles[:, 0] / n * 360.0 - 180.0
+    lat_rad = np.arctan(np.sinh(np.pi * (1 - 2 * tiles[:, 1] / n)))
+    lat_deg = np.degrees(lat_rad)
+    return np.stack((lon_deg, lat_deg), axis=1).tolist()
+
+
+def site_details_dir():
+    return os.path.join(build_dir, "site_details")
+
+
+def site_shard(site_id):
+    """ The number of the site details file that contains the given site.
+    """
+    return int(site_id) // SITE_SHARD_SIZE
 
 
 def create_geojson():
     """ Create the sitesgeo.json that the leaflet markers are created
     from.
+
+    The sitesgeo.json only contains what is needed to place the markers.
+    The popup content and the bounds of the detailed map are written into
+    the site details files that are loaded when a popup is opened. Each of
+    these files contains the details of SITE_SHARD_SIZE consecutive site ids.
     """
     from jinja2 import Environment, FileSystemLoader
     env = Environment(loader=FileSystemLoader("templates"))
@@ -157,27 +147,46 @@ def create_geojson():
     with open(os.path.join(build_dir, "detailed_maps.json")) as sitesjs:
         detailed_maps = json.loads(sitesjs.read())
 
+    # The latest events of each site are shown in its popup
+    history_limit = conf.getint("Map", "site_history", fallback=10)
+    legends_db = None
+    if history_limit > 0 and os.path.exists(legends_db_file()):
+        legends_db = legendsdb.open_db(legends_db_file())
+
+    # Project all coordinates at once
+    lonlats = xy2lonlat([site["coords"] for site in sites])
+
     features = []
-    for site in sites:
-        feature = {"type":"Feature",
-                   "properties": {
-                       "name": site["name"],
-                       "type": site["type"],
-                       "id": site["id"],
-                       "img": "/icons/{}.png".format(site["type"].replace(" ", "_")),
-                       "popupContent": tooltip_template.render({"site":site, "detailed_maps": detailed_maps}),
-                   },
-                   "geometry": {
-                       "type": "Point",
-                       "coordinates": xy2lonlat(*site["coords"])
-                   }
-        }
-
-        # Add the bounding rect for the detailed map to the geojson info.
-        if site["id"] in detailed_maps:
+    # Maps { shard -> site id -> details }
+    details = collections.defaultdict(dict)
+    map_corners = []
+    for site, lonlat in zip(sites, lonlats):
+        history = []
+        if legends_db is not None:
+            history = legendsdb.site_history(legends_db, site["id"], history_limit)
+
+        features.append({"type":"Feature",
+                         "properties": {
+                             "name": site["name"],
+                             "type": site["type"],
+                             "id": site["id"],
+                         },
+                         "geometry": {
+                             "type": "Point",
+                             "coordinates": lonlat
+                         }
+        })
+
+        detailed_map = detailed_maps.get(site["id"])
+        site_details = {"popupContent": tooltip_template.render({"site": site, "detailed_map": detailed_map,
+                                                                 "history": history})}
+        details[site_shard(site["id"])][site["id"]] = site_details
+
+        # Add the bounding rect for the detailed map to the site details.
+        if detailed_map:
             # The detailed maps use 48px big blocks
-            width  = detailed_maps[site["id"]]["px_width"]  // 48
-            height = detailed_maps[site["id"]]["px_height"] // 48
+            width  = detailed_map["px_width"]  // 48
+            height = detailed_map["px_height"] // 48
 
             # These coords are not really geojson as they are used directly by leaflet
             # and leaflet uses the coordinates switched around (y,x)
@@ -185,18 +194,109 @@ def create_geojson():
             # corner. Hurray...
             southwest = [site["coords"][0] - width // 2, site["coords"][1] - height // 2]
             northeast = [site["coords"][0] + width // 2, site["coords"][1] + height // 2]
+            map_corners.append((site_details, southwest, northeast))
 
-            sw_lat_lon = xy2lonlat(*southwest)
-            ne_lat_lon = xy2lonlat(*northeast)
-            feature["properties"]["map_bounds"] = [[sw_lat_lon[1], sw_lat_lon[0]],
-                                                   [ne_lat_lon[1], ne_lat_lon[0]]]
-
-        features.append(feature)
+    if map_corners:
+        corners = xy2lonlat([corner for (site_details, southwest, northeast) in map_corners
+                                    for corner in (southwest, northeast)])
+        for index, (site_details, southwest, northeast) in enumerate(map_corners):
+            sw_lat_lon, ne_lat_lon = corners[2 * index], corners[2 * index + 1]
+            site_details["map_bounds"] = [[sw_lat_lon[1], sw_lat_lon[0]],
+                                          [ne_lat_lon[1], ne_lat_lon[0]]]
 
     with open(os.path.join(build_dir, "sitesgeo.json"), "w") as sitesjson:
         sitesjson.write(json.dumps({"type": "FeatureCollection",
                                     "features": features}))
 
+    # Replace the details files of the last run, the sites might be different
+    if os.path.exists(site_details_dir()):
+        shutil.rmtree(site_details_dir())
+    os.makedirs(site_details_dir())
+    for shard, shard_details in details.items():
+        with open(os.path.join(site_details_dir(), "{}.json".format(shard)), "w") as detailsjson:
+            detailsjson.write(json.dumps(shard_details))
+
+
+def marker_tiles_dir():
+    return os.path.join(build_dir, "markers")
+
+
+def create_marker_tiles():
+    """ Cluster the sites of the sitesgeo.json for every zoom level and
+    write the markers into one file per map tile: markers/{z}/{x}/{y}.json
+
+    Tiles without markers are not written, markers/{z}/index.json lists the
+    tiles that have a file. On the highest zoom level the sites are not
+    clustered anymore.
+    """
+    with open(os.path.join(build_dir, "sitesgeo.json")) as sitesjson:
+        features = json.loads(sitesjson.read())["features"]
+    sites = [feature["properties"] for feature in features]
+    lonlats = [feature["geometry"]["coordinates"] for feature in features]
+
+    max_zoom = conf.getint("Map", "max_zoom")
+    radius = conf.getint("Map", "max_cluster_radius")
+
+    # Replace the tiles of the last run, the clusters might be different
+    if os.path.exists(marker_tiles_dir()):
+        shutil.rmtree(marker_tiles_dir())
+
+    for level in range(max_zoom + 1):
+        tiles = markers.zoom_markers(sites, lonlats, level, radius if level < max_zoom else 0)
+        for (x, y), tile_markers in tiles.items():
+            tile_dir = os.path.join(marker_tiles_dir(), str(level), str(x))
+            os.makedirs(tile_dir, exist_ok=True)
+            with open(os.path.join(tile_dir, "{}.json".format(y)), "w") as tilejson:
+                tilejson.write(json.dumps(tile_markers))
+
+        os.makedirs(os.path.join(marker_tiles_dir(), str(level)), exist_ok=True)
+        with open(os.path.join(marker_tiles_dir(), str(level), "index.json"), "w") as indexjson:
+            indexjson.write(json.dumps(markers.tile_index(tiles)))
+        logging.debug("Zoom level {}: {} markers in {} tiles".format(
+            level, sum(len(tile_markers) for tile_markers in tiles.values()), len(tiles)))
+
+
+def search_index_dir():
+    return os.path.join(build_dir, "search")
+
+
+def create_search_index():
+    """ Write the paged site list and the search index for the sidebar into
+    the search directory (see uristmaps.search).
+    """
+    with open(os.path.join(build_dir, "sitesgeo.json")) as sitesjson:
+        features = json.loads(sitesjson.read())["features"]
+    with open(os.path.join(build_dir, "sites.json")) as sitesjson:
+        owners = {site["id"]: site.get("civ") for site in json.loads(sitesjson.read())}
+
+    sites = []
+    for feature in features:
+        site = {"id": feature["properties"]["id"],
+                "name": feature["properties"]["name"],
+                "type": feature["properties"]["type"],
+                "lon": feature["geometry"]["coordinates"][0],
+                "lat": feature["geometry"]["coordinates"][1]}
+        if owners.get(site["id"]):
+            site["owner"] = owners[site["id"]]
+        sites.append(site)
+
+    # Replace the index of the last run, the sites might be different
+    if os.path.exists(search_index_dir()):
+        shutil.rmtree(search_index_dir())
+
+    types, pages = search.type_pages(sites)
+    files = {"types.json": types}
+    for (key, page), page_sites in pages.items():
+        files[os.path.join("types", key, "{}.json".format(page))] = page_sites
+    for prefix, prefix_sites in search.prefix_shards(sites).items():
+        files[os.path.join("prefix", "{}.json".format(prefix))] = prefix_sites
+
+    for name, data in files.items():
+        fname = os.path.join(search_index_dir(), name)
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        with open(fname, "w") as indexjson:
+            indexjson.write(json.dumps(data))
+
 
 def load_detailed_maps():
     """ Convert the bmp in the region dir to the output dir as png.
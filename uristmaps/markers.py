@@ -0,0 +1,105 @@
+""" Cluster the site markers for every zoom level ahead of time.
+
+The map shows a marker for every site, sites that are too close to each
+other at the current zoom level are combined into one cluster marker. The
+clusters are computed here for each zoom level and split up by the map tile
+they are shown on, so the browser only loads the markers of the tiles that
+are visible instead of clustering all sites itself.
+
+Sites are clustered on a grid of max_cluster_radius big cells in pixel
+coordinates of the zoom level, all sites in one cell form a cluster.
+"""
+import numpy as np
+
+# Size of the map tiles in px, the markers are split up by these tiles
+TILE_SIZE = 256
+
+
+def project(lonlats, zoom):
+    """ Convert the (lon, lat) coordinates into the pixel coordinates of the
+    map at the given zoom level (the spherical mercator leaflet uses).
+    Returns an (n, 2) array of (x, y).
+    """
+    lonlats = np.asarray(lonlats, dtype=np.float64).reshape(-1, 2)
+    size = TILE_SIZE * 2.0 ** zoom
+    x = (lonlats[:, 0] + 180.0) / 360.0 * size
+    lat_rad = np.radians(lonlats[:, 1])
+    y = (1 - np.arcsinh(np.tan(lat_rad)) / np.pi) / 2 * size
+    return np.stack((x, y), axis=1)
+
+
+def unproject(pixels, zoom):
+    """ Inverse of project, returns an (n, 2) array of (lon, lat).
+    """
+    pixels = np.asarray(pixels, dtype=np.float64).reshape(-1, 2)
+    size = TILE_SIZE * 2.0 ** zoom
+    lon = pixels[:, 0] / size * 360.0 - 180.0
+    lat = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * pixels[:, 1] / size))))
+    return np.stack((lon, lat), axis=1)
+
+
+def cluster(pixels, radius):
+    """ Put the points at the pixel coordinates into clusters.
+
+    Returns (clusters, count) with clusters[i] being the number of the
+    cluster of point i. The clusters are numbered in the order of their
+    grid cells.
+    """
+    if not len(pixels):
+        return np.zeros(0, dtype=np.intp), 0
+    cells = np.floor(pixels / radius).astype(np.int64)
+    keys, clusters = np.unique(cells, axis=0, return_inverse=True)
+    return clusters.reshape(-1), len(keys)
+
+
+def zoom_markers(sites, lonlats, zoom, radius):
+    """ Create the markers for the sites at one zoom level.
+
+    sites are the properties of the sites (name, type, id) and lonlats
+    their positions. A radius of 0 disables the clustering.
+    Returns { (tile_x, tile_y) -> list of markers }. Each marker is a dict
+    with lat and lon and either the site properties for single sites
+    or the count and bounds of the sites in a cluster.
+    """
+    pixels = project(lonlats, zoom)
+    if radius:
+        clusters, count = cluster(pixels, radius)
+    else:
+        clusters, count = np.arange(len(pixels)), len(pixels)
+
+    sizes = np.bincount(clusters, minlength=count)
+    centers = np.zeros((count, 2))
+    np.add.at(centers, clusters, pixels)
+    centers /= np.maximum(sizes, 1)[:, None]
+    center_lonlats = unproject(centers, zoom)
+
+    # Bounding boxes of the clusters as (min lon, min lat) and (max lon, max lat)
+    lonlats = np.asarray(lonlats, dtype=np.float64).reshape(-1, 2)
+    lower = np.full((count, 2), np.inf)
+    upper = np.full((count, 2), -np.inf)
+    np.minimum.at(lower, clusters, lonlats)
+    np.maximum.at(upper, clusters, lonlats)
+
+    # The first site of each cluster, the only one for clusters of single sites
+    first_site = np.argsort(clusters, kind="stable")[np.cumsum(sizes) - sizes]
+
+    tiles = {}
+    for index in range(count):
+        lon, lat = center_lonlats[index]
+        if sizes[index] == 1:
+            site = sites[first_site[index]]
+            lon, lat = lonlats[first_site[index]]
+            marker = {"lat": lat, "lon": lon, "id": site["id"], "name": site["name"], "type": site["type"]}
+        else:
+            marker = {"lat": lat, "lon": lon, "count": int(sizes[index]),
+                      "bounds": [[lower[index][1], lower[index][0]], [upper[index][1], upper[index][0]]]}
+        tile = tuple(int(coord) for coord in centers[index] // TILE_SIZE)
+        tiles.setdefault(tile, []).append(marker)
+    return tiles
+
+
+def tile_index(tiles):
+    """ List the keys "x/y" of the tiles with markers returned by
+    zoom_markers. The browser only requests the marker files of these tiles.
+    """
+    return ["{}/{}".format(x, y) for (x, y) in sorted(tiles)]
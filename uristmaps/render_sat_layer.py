@@ -1,195 +1,594 @@
-import os, sys, logging, traceback
-import json
+import os, sys, logging, traceback, io
 import math
 import itertools
-from multiprocessing import Pool
+import collections
+from multiprocessing import Pool, Barrier, util
 
 from clint.textui import progress
 
+import numpy as np
+
 from PIL import Image
 
 from doit import get_var
 
-from . import tilesets
+from . import tilesets, compositor, tilestore, artifacts, world, tilegrid
 from uristmaps.config import conf
 
 
 paths = conf["Paths"] # Reference to that conf section to make the lines a bit shorter. Unlinke this one which still gets really long.
 
+# The world data of a render process. It is set up once per process by
+# init_render_process so the single tasks only need to carry the coordinates
+# of their tile instead of pickling the whole world for every tile.
+render_state = {}
+
 
-def load_biomes_map():
-    """ Load heightmap json.
+def load_world():
+    """ Load the memory-mapped biome and structure grids.
+
+    Returns the tuple (worldsize, names, struct_offset, biome_grid, struct_grid).
+    Both grids are indexed [y, x]. The biome grid contains indices into the
+    names list and the structure grid indices into names[struct_offset:].
+    The structure index 0 is the empty name "" which marks the absence of a
+    structure.
     """
-    with open("{}/biomes.json".format(paths["build"]),"r") as biomejson:
-        biomes = json.loads(biomejson.read())
+    biome_grid, biome_names = artifacts.load_grid("biomes")
+    struct_grid, struct_names = artifacts.load_grid("structs")
+    return biome_grid.shape[0], biome_names + struct_names, len(biome_names), biome_grid, struct_grid
 
-    return biomes
 
-def load_structures_map():
-    with open("{}/structs.json".format(paths["build"]),"r") as structjson:
-        structs = json.loads(structjson.read())
-    return structs
+def render_all():
+    """ Render all levels up to max_zoom in a single pass.
+
+    In pyramid mode only max_zoom is rendered from the world and all other
+    levels are scaled down from the level above.
+    """
+    max_zoom = conf.getint("Map", "max_zoom")
+    if conf.getboolean("Map", "pyramid", fallback=False):
+        return render_levels([max_zoom], range(max_zoom - 1, 0, -1))
+    else:
+        return render_levels(range(1, max_zoom + 1), [])
 
 
 def render_layer(level):
-    """ Render all image tiles for the specified level.
+    """ Render all image tiles for the specified level from the world.
+    Used when this module is run as a script.
     """
-    biomes = load_biomes_map()
-    structures = load_structures_map()
+    return render_levels([level], [])
 
-    # Determine wich will be the first zoom level to use graphic tiles
-    # bigger than 1px:
-    zoom_offset = 0
-    mapsize = 256
-    while mapsize < biomes["worldsize"]:
-        mapsize *= 2
-        zoom_offset += 1
 
-    # Zoom level 'zoom_offset' will be the first in which the world can
-    # be rendered onto the map using 1px sized tiles.
+def render_levels(native_levels, scaled_levels):
+    """ Render the tiles of several levels using a single pool of processes.
 
-    tile_amount = int(math.pow(2,level))
+    The world is loaded only once. The tiles of all native_levels are rendered
+    from the world and then the scaled_levels are built in the given order by
+    scaling down the level above each of them.
 
-    graphic_size = int(math.pow(2, level - zoom_offset))
+    Returns False when tiles failed to render, which makes the doit task fail.
+    """
+    worldsize, names, struct_offset, biome_grid, struct_grid = load_world()
+    zoom_offset = world.load_manifest()["zoom_offset"]
 
-    # Dont render this layer when the world would not even fit if the tiles were 1px big
-    # TODO: Find way to render this: Only draw every <n> world tiles or render big and scale down
-    if graphic_size == 0:
-        return
+    # The tasks are run in steps. All tasks of a step have to be done before
+    # the next step starts.
+    steps = []
+    atlases = {}
+    rendered_levels = []
+
+    # Levels that are rendered completely, their shared images are made anew
+    full_levels = []
+
+    native_tasks = []
+    for level in native_levels:
+        graphic_size = int(math.pow(2, level - zoom_offset))
+
+        # Dont render this layer when the world would not even fit if the tiles were 1px big.
+        # Use the pyramid mode to build these layers by scaling down the layers above.
+        if graphic_size == 0:
+            continue
+
+        tiles, full = select_tiles(level, zoom_offset, names, struct_offset, biome_grid, struct_grid)
+        rendered_levels.append(level)
+        if full:
+            full_levels.append(level)
+        if not tiles:
+            print("No changes on level {}.".format(level))
+            continue
+
+        atlases[level] = load_atlas(names, graphic_size)
+
+        # Group the tiles into metatiles of metatile x metatile tiles that are
+        # composited together as one image by a single task.
+        metatile = conf.getint("Performance", "metatile", fallback=1)
+        blocks = collections.defaultdict(list)
+        for (x, y) in tiles:
+            blocks[(x // metatile, y // metatile)].append((x, y))
+        native_tasks.extend((level, block) for block in blocks.values())
+    steps.append(native_tasks)
+
+    for level in scaled_levels:
+        tiles, full = select_tiles(level, zoom_offset, names, struct_offset, biome_grid, struct_grid)
+        rendered_levels.append(level)
+        if full:
+            full_levels.append(level)
+        if not tiles:
+            print("No changes on level {}.".format(level))
+            continue
+        steps.append([(level, [tile]) for tile in tiles])
+
+    # Shared images of an older render might have been made from another
+    # tileset or by scaling instead of rendering
+    if full_levels:
+        store = open_tile_store()
+        for level in full_levels:
+            store.clear_shared(level)
+        store.close()
+
+    steps = [tasks for tasks in steps if tasks]
+    failed_levels = set()
+    if steps:
+        # The processes map the world grids themselves to share their pages
+        state = {"zoom_offset": zoom_offset,
+                 "atlases": atlases,
+                 "encoder": open_tile_encoder(atlases.values())}
+        failed_levels = run_tasks(steps, state, "Rendering levels {} ".format(
+                                  ", ".join(str(level) for level in rendered_levels)))
+
+    # Levels with failed tiles keep their old snapshot, so the next
+    # incremental render tries these tiles again. The same goes for the
+    # levels scaled down from them.
+    failed_levels = tilegrid.failed_levels(failed_levels, scaled_levels)
+    for level in rendered_levels:
+        if level not in failed_levels:
+            save_snapshot(level, names, struct_offset, biome_grid, struct_grid)
+
+    if failed_levels:
+        print("Rendering failed for tiles of levels {}.".format(
+              ", ".join(str(level) for level in sorted(failed_levels))))
+        return False
+
+
+def load_atlas(names, graphic_size):
+    """ Load the tilesheet and stack its images in the order of the names list.
+    """
+    TILES = tilesets.get_tileset(graphic_size)
+    for name in names:
+        if name and name not in TILES:
+            logging.warning("No tile image for '{}' in the {}px tileset".format(name, graphic_size))
+    return compositor.build_atlas(TILES, names, graphic_size)
+
+
+def select_tiles(level, zoom_offset, names, struct_offset, biome_grid, struct_grid):
+    """ Determine the list of tiles of the level that have to be rendered.
+
+    This is every tile of the level that shows a part of the world unless
+    the incremental mode is enabled and there is a snapshot of the world this
+    level was last rendered from. Then only the tiles that contain changed
+    world tiles are returned.
+    Tiles that lie completely in the empty area around the world are never
+    rendered.
+
+    Returns the tuple (tiles, full) with full being True when the whole
+    level is rendered.
+    """
+    worldsize = biome_grid.shape[0]
+    clear_tiles, cells_per_tile = tilegrid.tile_geometry(level, zoom_offset, worldsize)
+    first = clear_tiles // cells_per_tile
+    last = (clear_tiles + worldsize - 1) // cells_per_tile
+    all_tiles = list(itertools.product(range(first, last + 1), repeat=2))
+
+    if not conf.getboolean("Performance", "incremental", fallback=False):
+        return all_tiles, True
+
+    changed = changed_cells(level, names, struct_offset, biome_grid, struct_grid)
+    if changed is None:
+        return all_tiles, True
+
+    return tilegrid.dirty_tiles(level, zoom_offset, changed), False
+
+
+def snapshot_file(level):
+    """ The path of the world snapshot the given level was last rendered from.
+    """
+    return os.path.join(paths["build"], "render_snapshots", "{}.npz".format(level))
+
+
+def save_snapshot(level, names, struct_offset, biome_grid, struct_grid):
+    """ Remember the world the level has been rendered from to allow
+    incremental rendering of the next export.
+    """
+    os.makedirs(os.path.dirname(snapshot_file(level)), exist_ok=True)
+    np.savez_compressed(snapshot_file(level), names=np.array(names),
+                        struct_offset=struct_offset, biome_grid=biome_grid, struct_grid=struct_grid,
+                        output=np.array(output_settings()))
+
+
+def output_settings():
+    """ Describe where and how the tiles are stored. When this changes
+    the tiles of the last render can not be reused.
+    """
+    return "{}:{}".format(conf.get("Output", "tile_backend", fallback="files"), tile_format())
+
+
+def changed_cells(level, names, struct_offset, biome_grid, struct_grid):
+    """ Compare the world with the snapshot of the last render of the level.
+
+    Returns a boolean grid marking the world tiles with a different biome or
+    structure. Returns None when there is no usable snapshot and the whole
+    level has to be rendered.
+    """
+    if not os.path.exists(snapshot_file(level)):
+        return None
+
+    snapshot = np.load(snapshot_file(level))
+    if snapshot["biome_grid"].shape != biome_grid.shape or \
+       "output" not in snapshot or str(snapshot["output"]) != output_settings() or \
+       "struct_offset" not in snapshot:
+        return None
+
+    return tilegrid.changed_cells(snapshot, names, struct_offset, biome_grid, struct_grid)
+
+
+def run_tasks(steps, state, label):
+    """ Send the tasks to a pool of render processes and show the progress
+    of all of them in one bar.
+
+    steps is a list of task lists. Each task is a tuple (level, tiles) with
+    the list of tiles of the level to render. The tasks of one step are only
+    started when all tasks of the previous step are done.
+
+    The state dict holds the data shared by all tasks. It is handed to
+    each process only once when it starts and is available as render_state
+    inside the processes.
+
+    Returns the set of levels with tiles that failed to render.
+    """
+    total = sum(len(tiles) for tasks in steps for (level, tiles) in tasks)
 
     # Read max number of processes
     process_count = conf.getint("Performance", "processes")
 
-    # Chunk the amount of tiles to render in equals parts
-    # for each process. This would be the ideal chunk size to keep
-    # processes from coming back the pool to get more work. That just
-    # costs time apparently.
-    chunk = tile_amount ** 2
-
-    # Limiting the chunksize helps getting more frequent updates for the progress bar
-    # This slows the operation a bit down, though (about 1.5sek for zoom lvl 6...)
-    chunk = min(chunk, 2048)
-    
-    # Have maximum as many processes as there are chunks so we don't have more
-    # processes than there is work available.
-    process_count = min(process_count, chunk)
-    chunk //= process_count
-
-    # Setup multiprocessing pool
-    pool = Pool(process_count)
-
-    # Load the tilesheet
-    TILES = tilesets.get_tileset(graphic_size)
+    # Have maximum as many processes as there are tasks in the biggest step
+    # so we don't have more processes than there is work available.
+    process_count = min(process_count, max(len(tasks) for tasks in steps))
 
     # Save the path to the config file in a pid file for this process' children
     with open(".{}.txt".format(os.getpid()), "w") as pidfile:
         pidfile.write(get_var("conf", "config.cfg"))
 
-    # Send the tile render jobs to the pool. Generates the parameters for each tile
-    # with the get_tasks function.
-    a = pool.imap_unordered(render_tile_mp, get_tasks(tile_amount, level, zoom_offset, biomes, structures, TILES), chunksize=chunk)
+    # Make sure the tile store is set up before the processes start writing
+    store = open_tile_store()
+    store.set_metadata({"name": "Uristmaps",
+                        "format": tile_extension(),
+                        "type": "baselayer",
+                        "minzoom": 1,
+                        "maxzoom": conf.getint("Map", "max_zoom")})
+    store.close()
+
+    # Setup multiprocessing pool. The shared data is handed to each
+    # process only once when it starts.
+    state = dict(state, barrier=Barrier(process_count))
+    pool = Pool(process_count, initializer=init_render_process, initargs=(state,))
 
     counter = 0
-    total = tile_amount**2
+    failed_levels = set()
 
     # Show a nice progress bar with integrated ETA estimation
-    with progress.Bar(label="Using {}px sized tiles ".format(graphic_size), expected_size=total) as bar:
-        for b in a:
-            counter += 1
-            bar.show(counter)
+    with progress.Bar(label=label, expected_size=total) as bar:
+        for step, tasks in enumerate(steps):
+            if step > 0:
+                sync_processes(pool, process_count)
+
+            # Chunk the amount of tiles to render in equals parts
+            # for each process. This would be the ideal chunk size to keep
+            # processes from coming back the pool to get more work. That just
+            # costs time apparently.
+            # Limiting the chunksize helps getting more frequent updates for the progress bar
+            # This slows the operation a bit down, though (about 1.5sek for zoom lvl 6...)
+            chunk = max(min(len(tasks), 2048) // process_count, 1)
+
+            # Send the tile render jobs to the pool.
+            for level, tile_count, ok in pool.imap_unordered(render_task_mp, tasks, chunksize=chunk):
+                if not ok:
+                    failed_levels.add(level)
+                counter += tile_count
+                bar.show(counter)
 
     pool.close()
     pool.join()
 
+    # Remove the images that have been replaced by the new tiles
+    store = open_tile_store()
+    store.prune()
+    store.close()
+
     # Remove the pidfile containing the config path
     if os.path.exists(".{}.txt".format(os.getpid())):
         os.remove(".{}.txt".format(os.getpid()))
 
+    return failed_levels
+
 
-def get_tasks(tileamount, level, zoom_offset, biomes, structures, tiles):
-    """ Generate the parameters for render_tile_mp calls for every tile
-    that will be rendered. Each set of parameters is a single task for a
-    process.
+def sync_processes(pool, process_count):
+    """ Make every process of the pool write its pending tiles into the
+    tile store, so the next step can read them.
+
+    Each process blocks on the barrier after flushing until all processes
+    got there. This way every process picks up exactly one of the tasks.
     """
-    for x, y in itertools.product(range(tileamount), repeat=2):
-        yield (x, y, level, zoom_offset, biomes, structures, tiles)
+    pool.map(flush_tile_store, range(process_count), chunksize=1)
+
 
+def flush_tile_store(_):
+    render_state["store"].flush()
+    render_state["barrier"].wait()
 
-def render_tile_mp(opts):
-    """ Wrapper function used by the process pool to call render_tile.
-    Unpacks the list of parameters and retrieves the exceptions that
-    might be raised in the processes and get otherwise lost.
+
+def init_render_process(state):
+    """ Initializer of the render processes. Stores the data shared by
+    all tiles in the render_state of this process and opens the tile store
+    the process writes into.
     """
+    render_state.update(state)
+
+    worldsize, names, struct_offset, biome_grid, struct_grid = load_world()
+    render_state.update(names=names, struct_offset=struct_offset,
+                        biome_grid=biome_grid, struct_grid=struct_grid)
+
+    # The store collects writes in batches, make sure the last batch is
+    # written when the process is shut down by the pool.
+    render_state["store"] = open_tile_store()
+    util.Finalize(render_state["store"], render_state["store"].close, exitpriority=10)
+
+
+def render_task_mp(opts):
+    """ Wrapper function used by the process pool to render a list of tiles.
+    Tiles of levels with an atlas are rendered from the world, all others
+    are scaled down from the level above.
+
+    Combines the tile coordinates with the world data of this process and
+    retrieves the exceptions that might be raised in the processes and get
+    otherwise lost. Returns the tuple (level, number of tiles, success).
+    """
+    level, tiles = opts
+    s = render_state
     try:
-        render_tile(*opts)
+        if level in s["atlases"]:
+            render_tiles(tiles, level, s["zoom_offset"], s["names"], s["struct_offset"], s["biome_grid"],
+                         s["struct_grid"], s["atlases"][level], s["store"], s["encoder"])
+        else:
+            for (tile_x, tile_y) in tiles:
+                downsample_tile(tile_x, tile_y, level, s["zoom_offset"], s["names"], s["biome_grid"],
+                                s["struct_grid"], s["store"], s["encoder"])
     except Exception as e:
         print("Exception in working process: {}".format(type(e)))
         traceback.print_exc()
+        return level, len(tiles), False
+    return level, len(tiles), True
+
 
+def render_tiles(tiles, level, zoom_offset, names, struct_offset, biome_grid, struct_grid, atlas, store, encoder):
+    """ Render the world map tiles with the given indeces at the provided level.
 
-def render_tile(tile_x, tile_y, level, zoom_offset, biomes, structures, tiles):
-    """ Render the world map tile with the given indeces at the provided level.
+    All tiles that are not shared images are composited together as one
+    image covering the square block around them which is then sliced into
+    the single tiles.
     """
-    worldsize = biomes["worldsize"] # Convenience shortname
-    image = Image.new("RGBA", (256, 256), "white")
+    worldsize = biome_grid.shape[0] # Convenience shortname
+    clear_tiles, tiles_per_block = tilegrid.tile_geometry(level, zoom_offset, worldsize)
+
+    composite = []
+    for (tile_x, tile_y) in tiles:
+        # World coordinate of the upper left world tile in this map tile
+        left = tile_x * tiles_per_block - clear_tiles
+        top = tile_y * tiles_per_block - clear_tiles
+
+        # Tiles showing nothing but a single biome all look the same and are only
+        # composited once.
+        key = uniform_key(left, top, tiles_per_block, level, names, biome_grid, struct_grid)
+        if key and store.link(key, level, tile_x, tile_y):
+            continue
+        composite.append((tile_x, tile_y, key))
 
-    # The size of graphic-tiles that will be used for rendering
-    graphic_size = int(math.pow(2, level - zoom_offset))
+    if not composite:
+        return
 
-    # Calculate the size of the rendered world in tiles
-    render_size = 256 * math.pow(2, level)
+    first_x = min(tile_x for (tile_x, tile_y, key) in composite)
+    first_y = min(tile_y for (tile_x, tile_y, key) in composite)
+    block_size = max(max(tile_x - first_x, tile_y - first_y) for (tile_x, tile_y, key) in composite) + 1
 
-    # How many render tiles are kept clear left and top to center the world render
-    clear_tiles = 256 * math.pow(2, zoom_offset) - worldsize
-    clear_tiles //= 2 # Half it to get the offset left and top of the world.
+    pixels = compositor.composite(atlas, biome_grid, struct_grid,
+                                  first_x * tiles_per_block - clear_tiles,
+                                  first_y * tiles_per_block - clear_tiles,
+                                  block_size * tiles_per_block, struct_offset)
 
-    tiles_per_block = 256 // graphic_size
+    for (tile_x, tile_y, key) in composite:
+        px, py = (tile_x - first_x) * 256, (tile_y - first_y) * 256
+        image = Image.fromarray(pixels[py:py + 256, px:px + 256], "RGBA")
+        store.put(level, tile_x, tile_y, encoder.encode(image), key)
 
-    for render_tile_x in range(tiles_per_block):
-        global_tile_x = render_tile_x + tile_x * tiles_per_block
-        if global_tile_x < clear_tiles:
-            continue
-        if global_tile_x >= biomes["worldsize"] + clear_tiles:
-            break
-
-        for render_tile_y in range(tiles_per_block):
-            global_tile_y = render_tile_y + tile_y * tiles_per_block
-            if global_tile_y < clear_tiles:
-                continue
-            if global_tile_y >= biomes["worldsize"] + clear_tiles:
-                break
-
-            world_x = int(global_tile_x - clear_tiles)
-            world_y = int(global_tile_y - clear_tiles)
-            
-            location = (render_tile_x * graphic_size, render_tile_y * graphic_size)
-
-            # Render biome
-            img = tiles[biomes["map"][world_y][world_x]]
-            image.paste(img, location)
-
-            # Check if theres a structure to render on it
-
-            # TODO: Read the structures export to place tower/town sprites ontop the biomes
-            try:
-                struct_name = structures["map"][str(world_x)][str(world_y)]
-                try:
-                    struct = tiles[struct_name]
-                    image.paste(struct, location, struct)
-                except:
-                    log.warning("Could not render image: {}".format(struct_name))
-            except:
-                # No structure found
-                pass
-
-    target_dir = "{}/tiles/{}/{}/".format(paths["output"], level, tile_x)
-    if not os.path.exists(target_dir):
-        os.makedirs(target_dir)
-
-    fname = "{}/tiles/{}/{}/{}.png".format(paths["output"], level, tile_x, tile_y)
-    image.save(fname)
+
+class TileRenderer:
+    """ Renders single tiles on request inside of this process, for example
+    for the tile server.
+
+    The world is loaded once when the renderer is created and the atlas of
+    each tile size when it is first needed. Tiles of levels in which the world
+    does not fit using 1px sized tiles are scaled down from the level above.
+    """
+
+    def __init__(self):
+        self.worldsize, self.names, self.struct_offset, self.biome_grid, self.struct_grid = load_world()
+        self.zoom_offset = world.load_manifest()["zoom_offset"]
+        self.atlases = {}
+
+        # The palette for palette pngs is computed from the atlases of all native levels
+        atlases = []
+        if tile_format() == "png8":
+            for level in range(self.zoom_offset, conf.getint("Map", "max_zoom") + 1):
+                atlases.append(self.atlas(int(math.pow(2, level - self.zoom_offset))))
+        self.encoder = open_tile_encoder(atlases)
+
+    def atlas(self, graphic_size):
+        if graphic_size not in self.atlases:
+            tiles = tilesets.get_tileset(graphic_size)
+            self.atlases[graphic_size] = compositor.build_atlas(tiles, self.names, graphic_size)
+        return self.atlases[graphic_size]
+
+    def render(self, level, tile_x, tile_y):
+        """ Render the tile with the given indeces at the provided level.
+
+        Returns the tile as image or None when the tile does not show any
+        part of the world.
+        """
+        clear_tiles, cells_per_tile = tilegrid.tile_geometry(level, self.zoom_offset, self.worldsize)
+        left = tile_x * cells_per_tile - clear_tiles
+        top = tile_y * cells_per_tile - clear_tiles
+        if left + cells_per_tile <= 0 or top + cells_per_tile <= 0 or \
+           left >= self.worldsize or top >= self.worldsize:
+            return None
+
+        if level < self.zoom_offset:
+            children = {}
+            for dx, dy in itertools.product(range(2), repeat=2):
+                child = self.render(level + 1, tile_x * 2 + dx, tile_y * 2 + dy)
+                if child is not None:
+                    children[(dx, dy)] = child
+            return scale_down(children)
+
+        atlas = self.atlas(int(math.pow(2, level - self.zoom_offset)))
+        pixels = compositor.composite(atlas, self.biome_grid, self.struct_grid, left, top,
+                                      cells_per_tile, self.struct_offset)
+        return Image.fromarray(pixels, "RGBA")
+
+
+def downsample_tile(tile_x, tile_y, level, zoom_offset, names, biome_grid, struct_grid, store, encoder):
+    """ Create the tile with the given indeces at the provided level from the
+    four tiles covering the same area in the next higher level.
+    Missing tiles of the higher level are treated as empty white tiles.
+    """
+    clear_tiles, cells_per_tile = tilegrid.tile_geometry(level, zoom_offset, biome_grid.shape[0])
+    left = tile_x * cells_per_tile - clear_tiles
+    top = tile_y * cells_per_tile - clear_tiles
+
+    key = uniform_key(left, top, cells_per_tile, level, names, biome_grid, struct_grid)
+    if key and store.link(key, level, tile_x, tile_y):
+        return
+
+    children = {}
+    for dx, dy in itertools.product(range(2), repeat=2):
+        data = store.get(level + 1, tile_x * 2 + dx, tile_y * 2 + dy)
+        if data is not None:
+            children[(dx, dy)] = Image.open(io.BytesIO(data))
+
+    store.put(level, tile_x, tile_y, encoder.encode(scale_down(children)), key)
+
+
+def scale_down(children):
+    """ Combine 2x2 tiles into one image and scale it down to the size of a
+    single tile. children maps the offsets (dx, dy) of the tiles to their
+    images, missing tiles are left white.
+    """
+    image = Image.new("RGBA", (512, 512), "white")
+    for (dx, dy), child in children.items():
+        image.paste(child, (dx * 256, dy * 256))
+    return image.resize((256, 256), Image.BOX)
+
+
+def uniform_key(left, top, cells, level, names, biome_grid, struct_grid):
+    """ Check if the block of world tiles shown by a tile consists of only a
+    single biome without any structures.
+
+    Returns the name under which the image of such a tile is shared between
+    all tiles of the level that show the same biome. Returns None for all
+    other tiles.
+    """
+    worldsize = biome_grid.shape[0]
+    if left < 0 or top < 0 or left + cells > worldsize or top + cells > worldsize:
+        return None
+
+    if struct_grid[top:top + cells, left:left + cells].any():
+        return None
+
+    biomes = biome_grid[top:top + cells, left:left + cells]
+    if (biomes != biomes[0, 0]).any():
+        return None
+
+    return "{}-{}".format(level, names[biomes[0, 0]])
+
+
+# File extension of the tiles in each tile format
+TILE_EXTENSIONS = {"png": "png", "png8": "png", "webp": "webp", "webp_lossy": "webp"}
+
+
+def tile_format():
+    """ The configured format to encode the tiles in.
+    """
+    return conf.get("Output", "tile_format", fallback="png")
+
+
+def tile_extension():
+    """ The file extension of the tiles in the configured format.
+    """
+    return TILE_EXTENSIONS[tile_format()]
+
+
+class TileEncoder:
+    """ Encodes the tile images into the bytes of an image file.
+
+    The formats are
+        png: Full color png
+        png8: Palette png. The palette has to be given as list of (r, g, b) tuples.
+        webp: Lossless webp
+        webp_lossy: Lossy webp with the given quality
+    """
+
+    def __init__(self, tile_format, palette=None, compress_level=6, quality=80):
+        self.tile_format = tile_format
+        self.compress_level = compress_level
+        self.quality = quality
+
+        self.palette_image = None
+        if palette:
+            colors = [channel for color in palette for channel in color]
+            self.palette_image = Image.new("P", (1, 1))
+            self.palette_image.putpalette(colors + [0] * (768 - len(colors)))
+
+    def encode(self, image):
+        data = io.BytesIO()
+        if self.tile_format == "png8":
+            image = image.convert("RGB").quantize(palette=self.palette_image, dither=Image.Dither.NONE)
+            image.save(data, "PNG", compress_level=self.compress_level)
+        elif self.tile_format == "webp":
+            image.save(data, "WEBP", lossless=True, quality=self.quality)
+        elif self.tile_format == "webp_lossy":
+            image.convert("RGB").save(data, "WEBP", quality=self.quality)
+        else:
+            image.save(data, "PNG", compress_level=self.compress_level)
+        return data.getvalue()
+
+
+def open_tile_encoder(atlases):
+    """ Create the encoder for the configured tile format. The palette for
+    palette pngs is precomputed from the given atlases.
+    """
+    palette = None
+    if tile_format() == "png8":
+        palette = compositor.make_palette(atlases)
+    return TileEncoder(tile_format(), palette,
+                       compress_level=conf.getint("Output", "png_compress_level", fallback=6),
+                       quality=conf.getint("Output", "webp_quality", fallback=80))
+
+
+def open_tile_store(readonly=False):
+    """ Open the tile store configured as the tile backend. A readonly
+    store can only be read from.
+    """
+    if conf.get("Output", "tile_backend", fallback="files") == "mbtiles":
+        return tilestore.MBTilesStore(os.path.join(paths["output"], "tiles.mbtiles"), readonly=readonly)
+    return tilestore.FileStore(os.path.join(paths["output"], "tiles"), tile_extension())
 
 
 if __name__ == "__main__":
     render_layer(5)
-
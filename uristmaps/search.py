@@ -0,0 +1,86 @@
+""" Build the index the site list in the sidebar is searched and paged with.
+
+The index is split into many small JSON files so the page only loads what
+is shown:
+
+- types.json lists the site types with the amount of sites and pages.
+- types/{key}/{page}.json are the sites of one type sorted by name,
+  PAGE_SIZE sites per page.
+- prefix/{prefix}.json contains all sites with a word in their name, type
+  or owner that starts with the prefix (the first PREFIX_LENGTH letters
+  of the word). A search loads the file for the start of the query and
+  filters its sites.
+
+Every site in these files is a dict with id, name, type, lat, lon and the
+owner if it has one.
+"""
+import re, unicodedata, collections
+
+# Amount of sites in one page of the site list
+PAGE_SIZE = 100
+
+# Amount of letters of each word that are used to pick its prefix file
+PREFIX_LENGTH = 2
+
+# Everything that separates words
+SEPARATORS = re.compile("[^a-z0-9]+")
+
+
+def normalize(text):
+    """ Lowercase the text and replace the accented letters with the plain ones.
+    """
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(char for char in text if not unicodedata.combining(char))
+
+
+def words(text):
+    return [word for word in SEPARATORS.split(normalize(text)) if word]
+
+
+def site_words(site):
+    """ The words of the name, type and owner of the site the site can be found by.
+    """
+    return set(words(site["name"]) + words(site["type"]) + words(site.get("owner") or ""))
+
+
+def type_key(site_type):
+    """ The name of the directory of the pages of the site type.
+    """
+    return site_type.replace(" ", "_")
+
+
+def sort_key(site):
+    return normalize(site["name"]), int(site["id"])
+
+
+def type_pages(sites, page_size=PAGE_SIZE):
+    """ Split the sites up by type and into pages.
+
+    Returns (types, pages). types is the list of {type, key, count, pages}
+    sorted by type and pages maps (key, page) to the sites of that page.
+    """
+    by_type = collections.defaultdict(list)
+    for site in sites:
+        by_type[site["type"]].append(site)
+
+    types = []
+    pages = {}
+    for site_type in sorted(by_type):
+        type_sites = sorted(by_type[site_type], key=sort_key)
+        page_count = (len(type_sites) + page_size - 1) // page_size
+        types.append({"type": site_type, "key": type_key(site_type),
+                      "count": len(type_sites), "pages": page_count})
+        for page in range(page_count):
+            pages[(type_key(site_type), page)] = type_sites[page * page_size:(page + 1) * page_size]
+    return types, pages
+
+
+def prefix_shards(sites, prefix_length=PREFIX_LENGTH):
+    """ Map the prefix of every word to the sites that contain a word with it,
+    sorted by name.
+    """
+    shards = collections.defaultdict(list)
+    for site in sorted(sites, key=sort_key):
+        for prefix in {word[:prefix_length] for word in site_words(site)}:
+            shards[prefix].append(site)
+    return dict(shards)
@@ -1,15 +1,15 @@
-import os, json, glob
+import os, glob
 
 from jinja2 import Environment, FileSystemLoader
 
 from uristmaps import __version__
 from uristmaps.config import conf
 from uristmaps.filefinder import world_history
+from uristmaps import render_sat_layer, load_legends, search
 
 
 build_dir = conf["Paths"]["build"]
 tile_dir = conf["Paths"]["tiles"]
-tile_output_dir = "biome_legend/"
 
 def render_index():
     """ Create the index file and save it to the build dir.
@@ -30,11 +30,6 @@ def render_index():
     except IOError:
         print("Could not find world history file to resolve world name!")
 
-    # Get list of sites to write into sidebar
-    with open(os.path.join(build_dir, "sitesgeo.json")) as sitesjs:
-        sites_geojs = json.loads(sitesjs.read())
-    tpl_context["sites"] = sites_geojs["features"]
-
     ## Gather biome info for the legend
     tpl_context["biomes_legend"] = create_biomes_legend()
 
@@ -57,7 +52,10 @@ def render_uristjs():
     tpl_context = {
         "version"  : __version__,
         "max_zoom" : conf.getint("Map", "max_zoom"),
-        "max_cluster_radius" : conf.getint("Map", "max_cluster_radius")
+        "tile_extension" : render_sat_layer.tile_extension(),
+        "site_shard_size" : load_legends.SITE_SHARD_SIZE,
+        "search_page_size" : search.PAGE_SIZE,
+        "search_prefix_length" : search.PREFIX_LENGTH,
     }
 
     # Save the file to the build dir to finish
@@ -68,21 +66,26 @@ def render_uristjs():
         index_file.write(template.render(tpl_context))
 
 
-def create_biomes_legend():
-    """ Iterate over all tile images in tiles/32/ and
-    create a map for all non-structures mapping
-        { file_name -> /biome_legend/file_name }
-    This is processed by the _biome-legend.html template.
+def legend_images():
+    """ The 32px tile images of the biomes that are shown in the legend.
     """
     # keywords for image files that are blocked
     keywords = ["village", "river", "wall", "castle"]
+    return [img_file for img_file in sorted(glob.glob(os.path.join(tile_dir, "32", "*.png")))
+            if not [struct for struct in keywords if struct in img_file]]
+
+
+def create_biomes_legend():
+    """ Map the name of each biome in the legend to the name of its image in
+    the biomes sprite sheet:
+        { biome name -> file_name }
+    This is processed by the _biome-legend.html template.
+    """
     biomes = {}
-    for img_file in glob.glob(os.path.join(tile_dir, "32", "*.png")):
-        if [img_file for struct in keywords if struct in img_file]:
-            continue
+    for img_file in legend_images():
         # Resolve filename and remove file extension to use as biome name
         filename = os.path.splitext(os.path.basename(img_file))[0]
-        biomes[filename.replace("_", " ")] = tile_output_dir + os.path.basename(img_file)
+        biomes[filename.replace("_", " ")] = filename
     return biomes
 
 
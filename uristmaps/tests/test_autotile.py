@@ -0,0 +1,60 @@
+import numpy as np
+
+from uristmaps import autotile
+
+
+def expected_names(grid, names):
+    """ Name every cell by checking its four neighbours one by one.
+    """
+    height, width = grid.shape
+    result = {}
+    for y in range(height):
+        for x in range(width):
+            if grid[y, x] == 0:
+                continue
+            suffixes = ""
+            for dy, dx, suffix in ((-1, 0, "n"), (0, -1, "w"), (1, 0, "s"), (0, 1, "e")):
+                if 0 <= y + dy < height and 0 <= x + dx < width and grid[y + dy, x + dx] == grid[y, x]:
+                    suffixes += suffix
+            if suffixes:
+                result[(y, x)] = "{}_{}".format(names[grid[y, x]], suffixes)
+    return result
+
+
+def tile_names(grid, names):
+    tiles, tile_names = autotile.autotile(grid, names)
+    assert tile_names[0] == ""
+    return {(y, x): tile_names[tiles[y, x]] for y, x in zip(*np.nonzero(tiles))}
+
+
+class TestAutotile:
+
+    names = ["", "road", "village"]
+
+    def test_edges(self):
+        grid = np.array([[1, 1, 0, 2],
+                         [1, 0, 0, 2],
+                         [2, 2, 2, 1],
+                         [0, 1, 0, 1]], dtype=np.uint8)
+        tiles = tile_names(grid, self.names)
+        assert tiles == expected_names(grid, self.names)
+        assert tiles[(0, 0)] == "road_se"
+        assert tiles[(2, 1)] == "village_we"
+        # The lonely road at the bottom has no neighbour of its type
+        assert (3, 1) not in tiles
+
+    def test_random(self):
+        grid = np.random.RandomState(3).randint(0, 3, (20, 30)).astype(np.uint8)
+        assert tile_names(grid, self.names) == expected_names(grid, self.names)
+
+    def test_rivers(self):
+        village, river = (255, 255, 255), (0, 224, 255)
+        struct_rgb = np.array([[village, village, village]], dtype=np.uint8)
+        hydro_rgb = np.array([[(0, 0, 0), river, (0, 112, 255)]], dtype=np.uint8)
+        grid, names, unknown = autotile.decode_structures(struct_rgb, hydro_rgb)
+
+        assert [names[index] for index in grid[0]] == ["village", "river", "river"]
+        assert unknown == {}
+        tiles = tile_names(grid, names)
+        assert (0, 0) not in tiles
+        assert tiles[(0, 1)] == "river_e" and tiles[(0, 2)] == "river_w"
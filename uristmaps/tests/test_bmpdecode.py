@@ -0,0 +1,28 @@
+import numpy as np
+
+from uristmaps import bmpdecode
+
+
+class TestBmpDecode:
+
+    colors = {(0, 0, 255): 1, (0, 255, 0): 2, (255, 0, 0): 3}
+
+    def test_decode(self):
+        rgb = np.array([[(0, 0, 255), (0, 255, 0)],
+                        [(255, 0, 0), (0, 0, 255)]], dtype=np.uint8)
+        grid, unknown = bmpdecode.decode(rgb, self.colors)
+
+        assert grid.tolist() == [[1, 2], [3, 1]]
+        assert unknown == {}
+
+    def test_unknown_colors(self):
+        rgb = np.array([[(1, 2, 3), (0, 255, 0), (1, 2, 3)],
+                        [(255, 255, 255), (0, 0, 255), (255, 0, 0)]], dtype=np.uint8)
+        grid, unknown = bmpdecode.decode(rgb, self.colors, default=9)
+
+        assert grid.tolist() == [[9, 2, 9], [9, 1, 3]]
+        assert unknown == {(1, 2, 3): 2, (255, 255, 255): 1}
+
+    def test_pack(self):
+        packed = bmpdecode.pack(np.array([12, 34, 56], dtype=np.uint8))
+        assert bmpdecode.unpack(packed) == (12, 34, 56)
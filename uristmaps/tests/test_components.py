@@ -0,0 +1,55 @@
+import numpy as np
+
+from uristmaps import components
+
+
+def flood_fill(types):
+    """ Straightforward labelling to compare with, scanning column by column.
+    """
+    height, width = types.shape
+    labels = np.zeros(types.shape, dtype=int)
+    count = 0
+    for x in range(width):
+        for y in range(height):
+            if types[y, x] == 0 or labels[y, x]:
+                continue
+            count += 1
+            labels[y, x] = count
+            todo = [(x, y)]
+            while todo:
+                cx, cy = todo.pop()
+                for dx, dy in components.DEFAULT_NEIGHBOURS:
+                    for nx, ny in ((cx + dx, cy + dy), (cx - dx, cy - dy)):
+                        if 0 <= nx < width and 0 <= ny < height and not labels[ny, nx] \
+                           and types[ny, nx] == types[cy, cx]:
+                            labels[ny, nx] = count
+                            todo.append((nx, ny))
+    return labels, count
+
+
+class TestComponents:
+
+    def test_diagonals(self):
+        # Right-below connects, left-below does not
+        types = np.array([[1, 0, 0, 2],
+                          [0, 1, 2, 0],
+                          [0, 0, 1, 1]])
+        labels, count = components.label_components(types)
+        assert count == 3
+        assert labels.tolist() == [[1, 0, 0, 3],
+                                   [0, 1, 2, 0],
+                                   [0, 0, 1, 1]]
+
+    def test_matches_flood_fill(self):
+        rng = np.random.default_rng(4)
+        for _ in range(20):
+            types = rng.integers(0, 3, (13, 17))
+            labels, count = components.label_components(types)
+            expected, expected_count = flood_fill(types)
+            assert count == expected_count
+            assert (labels == expected).all()
+
+    def test_empty(self):
+        labels, count = components.label_components(np.zeros((4, 4), dtype=np.uint8))
+        assert count == 0
+        assert not labels.any()
@@ -0,0 +1,74 @@
+""" Test the numpy tile compositor against plain PIL pasting.
+"""
+import numpy as np
+
+from PIL import Image
+
+from uristmaps import compositor
+
+
+class TestCompositor:
+
+    size = 4
+    names = ["", "grass", "ocean", "village_ns"]
+
+    def make_tiles(self):
+        """ Create a small tileset with an opaque biome and a half transparent
+        structure sprite.
+        """
+        rng = np.random.RandomState(42)
+        tiles = {}
+        for name in self.names[1:]:
+            pixels = rng.randint(0, 256, (self.size, self.size, 4)).astype(np.uint8)
+            if not name.startswith("village"):
+                pixels[..., 3] = 255
+            tiles[name] = Image.fromarray(pixels, "RGBA")
+        return tiles
+
+    def test_composite_matches_paste(self):
+        """ The composited block has to be identical to pasting every
+        world tile with PIL.
+        """
+        tiles = self.make_tiles()
+        atlas = compositor.build_atlas(tiles, self.names, self.size)
+
+        biome_grid = np.array([[1, 2, 1], [2, 2, 1], [1, 1, 2]], dtype=np.uint16)
+        struct_grid = np.array([[0, 3, 0], [0, 0, 0], [3, 0, 0]], dtype=np.uint16)
+
+        # Render a block that overlaps the world by one tile on the left and top
+        cells = 4
+        result = compositor.composite(atlas, biome_grid, struct_grid, -1, -1, cells)
+
+        expected = Image.new("RGBA", (cells * self.size, cells * self.size), "white")
+        for y in range(3):
+            for x in range(3):
+                location = ((x + 1) * self.size, (y + 1) * self.size)
+                expected.paste(tiles[self.names[biome_grid[y, x]]], location)
+                if struct_grid[y, x]:
+                    struct = tiles[self.names[struct_grid[y, x]]]
+                    expected.paste(struct, location, struct)
+
+        assert (result == np.asarray(expected)).all(), "Composited tile differs from pasted tile!"
+
+    def test_composite_outside_world(self):
+        """ Blocks completely outside of the world are plain background.
+        """
+        atlas = compositor.build_atlas(self.make_tiles(), self.names, self.size)
+        grid = np.ones((2, 2), dtype=np.uint16)
+
+        result = compositor.composite(atlas, grid, np.zeros_like(grid), 5, 0, 2)
+
+        assert (result == compositor.BACKGROUND).all()
+
+    def test_palette(self):
+        """ The palette contains the background and every visible tile color.
+        """
+        tiles = self.make_tiles()
+        atlas = compositor.build_atlas(tiles, self.names, self.size)
+
+        palette = compositor.make_palette([atlas])
+
+        assert len(palette) <= 256
+        assert compositor.BACKGROUND[:3] in palette
+        for color in np.asarray(tiles["grass"].convert("RGB")).reshape(-1, 3).tolist():
+            assert tuple(color) in palette
@@ -0,0 +1,53 @@
+import gzip
+
+from uristmaps import dist
+
+
+class TestDist:
+
+    def setup_dirs(self, tmpdir, style):
+        res = tmpdir.mkdir("res")
+        res.mkdir("css").join("urist.css").write(style)
+        res.mkdir("js").join("icons.js").write("var icons = {};")
+        build = tmpdir.mkdir("build")
+        build.mkdir("js").join("urist.js").write("jQuery.getJSON('/js/search/' + path);")
+        build.join("index.html").write('<link href="/css/urist.css"><script src="/js/icons.js"></script>'
+                                       '<script src="/js/urist.js"></script><a href="/css/urist.css.map">'
+                                       '<link href="/sprites/icons.css">')
+        output = tmpdir.mkdir("output")
+        sprites = output.mkdir("sprites")
+        sprites.join("icons.css").write('.sprite-icons { background: url("icons.png"); }')
+        sprites.join("icons.png").write_binary(b"sheet")
+        return str(res), str(build), output
+
+    def test_make_dist(self, tmpdir):
+        res, build, output = self.setup_dirs(tmpdir, "body {}")
+        renames = dist.make_dist(res, build, str(output))
+
+        assert renames["/css/urist.css"] == dist.fingerprint("/css/urist.css", b"body {}")
+        assert dist.fingerprint_re.match(renames["/js/urist.js"])
+        index = output.join("index.html").read()
+        for url in ("/css/urist.css", "/js/icons.js", "/js/urist.js"):
+            assert output.join(renames[url]).check()
+            assert '"{}"'.format(renames[url]) in index
+        # Only complete references are replaced
+        assert '"/css/urist.css.map"' in index
+
+        # The sprite stylesheet refers to the fingerprinted sheet next to it
+        sheet = dist.fingerprint("/sprites/icons.png", b"sheet")
+        assert output.join(sheet).check()
+        assert 'url("{}")'.format(sheet.split("/")[-1]) in output.join(renames["/sprites/icons.css"]).read()
+        assert '"{}"'.format(renames["/sprites/icons.css"]) in index
+
+        assert gzip.decompress(output.join("index.html.gz").read_binary()) == index.encode()
+        assert output.join(renames["/js/urist.js"] + ".gz").check()
+
+    def test_old_versions_removed(self, tmpdir):
+        res, build, output = self.setup_dirs(tmpdir, "body {}")
+        old = dist.make_dist(res, build, str(output))["/css/urist.css"]
+        tmpdir.join("res", "css", "urist.css").write("body { margin: 0; }")
+        new = dist.make_dist(res, build, str(output))["/css/urist.css"]
+
+        assert old != new
+        assert not output.join(old).check() and not output.join(old + ".gz").check()
+        assert output.join(new).check() and output.join(new + ".gz").check()
@@ -0,0 +1,90 @@
+from uristmaps import legends
+
+
+LEGENDS = b"""<?xml version="1.0" encoding='UTF-8'?>
+<df_world>
+<regions>
+<region>
+<id>0</id>
+<name>the sites of nowhere</name>
+</region>
+</regions>
+<sites>
+<site>
+<id>1</id>
+<type>town</type>
+<name>bay\x01ed</name>
+<coords>3,5</coords>
+<structures>
+<structure>
+<id>0</id>
+<type>market</type>
+<name>the gr\xe9at market</name>
+</structure>
+<structure>
+<id>1</id>
+<type>temple</type>
+<name>the temple</name>
+</structure>
+</structures>
+</site>
+<site>
+<id>2</id>
+<type>cave</type>
+<name>the cave</name>
+<coords>7,2</coords>
+</site>
+</sites>
+<historical_events>
+<historical_event>
+<id>0</id>
+<type>created site</type>
+<civ_id>12</civ_id>
+<site_id>1</site_id>
+</historical_event>
+<historical_event>
+<id>1</id>
+<type>site taken over</type>
+<attacker_civ_id>13</attacker_civ_id>
+<site_id>1</site_id>
+</historical_event>
+<historical_event>
+<id>2</id>
+<type>hf died</type>
+<site_id>2</site_id>
+</historical_event>
+</historical_events>
+</df_world>
+"""
+
+
+class TestLegends:
+
+    def read(self, tmpdir, sections, chunk_size=legends.CHUNK_SIZE):
+        fname = tmpdir.join("region1-legends.xml")
+        fname.write_binary(LEGENDS)
+        return [(section, legends.read_site(element) if section == "sites" else
+                 legends.read_owner_change(element))
+                for section, element in legends.iter_sections(str(fname), sections, chunk_size)]
+
+    def test_sites(self, tmpdir):
+        entries = self.read(tmpdir, ["sites", "entities", "historical_events"])
+
+        assert entries[0] == ("sites", {"id": "1", "type": "town", "name": "bayed",
+                                        "coords": (3, 5),
+                                        "structures": [{"type": "market", "name": "the gr\xe9at market"},
+                                                       {"type": "temple", "name": "the temple"}]})
+        assert entries[1] == ("sites", {"id": "2", "type": "cave", "name": "the cave", "coords": (7, 2)})
+        assert entries[2:] == [("historical_events", ("1", "12")),
+                               ("historical_events", ("1", "13")),
+                               ("historical_events", None)]
+
+    def test_small_chunks(self, tmpdir):
+        # Tags are split between the chunks
+        for chunk_size in (1, 7, 64):
+            assert self.read(tmpdir, ["sites", "historical_events"], chunk_size) == \
+                   self.read(tmpdir, ["sites", "historical_events"])
+
+    def test_missing_section(self, tmpdir):
+        entries = self.read(tmpdir, ["entities", "sites"])
+        assert [site["id"] for section, site in entries] == ["1", "2"]
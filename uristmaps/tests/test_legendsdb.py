@@ -0,0 +1,33 @@
+from uristmaps import legendsdb
+from uristmaps.tests.test_legends import LEGENDS
+
+
+class TestLegendsDb:
+
+    def test_site_info(self, tmpdir):
+        fname = tmpdir.join("region1-legends.xml")
+        fname.write_binary(LEGENDS.replace(b"<historical_events>", b"""<historical_figures>
+<historical_figure>
+<id>4</id>
+<name>urist</name>
+<race>dwarf</race>
+<birth_year>-1</birth_year>
+</historical_figure>
+</historical_figures>
+<historical_events>"""))
+        db_file = str(tmpdir.join("legends.sqlite"))
+        legendsdb.ingest(str(fname), db_file)
+
+        connection = legendsdb.open_db(db_file)
+        site = legendsdb.site_info(connection, 1)
+        assert site["name"] == "bayed"
+        assert (site["x"], site["y"]) == (3, 5)
+        assert [structure["type"] for structure in site["structures"]] == ["market", "temple"]
+        assert [event["type"] for event in site["history"]] == ["created site", "site taken over"]
+        assert legendsdb.site_history(connection, 1, limit=1)[0]["type"] == "site taken over"
+        assert legendsdb.site_info(connection, 3) is None
+
+    def test_event_links(self):
+        links = list(legendsdb.event_links({"site_id": "3", "site_civ_id": "5", "slayer_hfid": "-1",
+                                            "group_hfid": ["1", "2"], "year": "100"}))
+        assert sorted(links) == [("entity", 5), ("hf", 1), ("hf", 2), ("site", 3)]
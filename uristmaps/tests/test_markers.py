@@ -0,0 +1,47 @@
+import numpy as np
+
+from uristmaps import markers
+
+
+SITES = [{"id": "1", "name": "first", "type": "town"},
+         {"id": "2", "name": "second", "type": "cave"},
+         {"id": "3", "name": "third", "type": "hamlet"}]
+
+# The first two sites are a few px apart at zoom level 2, the third is far away
+LONLATS = [[10.0, 20.0], [10.5, 20.5], [-100.0, -40.0]]
+
+
+class TestMarkers:
+
+    def test_projection(self):
+        assert markers.project([[0.0, 0.0]], 1).tolist() == [[256.0, 256.0]]
+        pixels = markers.project(LONLATS, 5)
+        assert np.allclose(markers.unproject(pixels, 5), LONLATS)
+
+    def test_clusters(self):
+        tiles = markers.zoom_markers(SITES, LONLATS, 2, 30)
+        found = [marker for tile_markers in tiles.values() for marker in tile_markers]
+        assert len(found) == 2
+
+        cluster = [marker for marker in found if "count" in marker][0]
+        assert cluster["count"] == 2
+        assert cluster["bounds"] == [[20.0, 10.0], [20.5, 10.5]]
+        assert 10.0 < cluster["lon"] < 10.5
+
+        site = [marker for marker in found if "count" not in marker][0]
+        assert (site["id"], site["lon"], site["lat"]) == ("3", -100.0, -40.0)
+        # Zoom level 2 has 4x4 tiles, the site is in the first column and third row
+        assert [tile for tile, tile_markers in tiles.items() if site in tile_markers] == [(0, 2)]
+
+    def test_no_clustering(self):
+        tiles = markers.zoom_markers(SITES, LONLATS, 2, 0)
+        found = sorted(marker["id"] for tile_markers in tiles.values() for marker in tile_markers)
+        assert found == ["1", "2", "3"]
+
+    def test_no_sites(self):
+        assert markers.zoom_markers([], [], 3, 30) == {}
+        assert markers.tile_index({}) == []
+
+    def test_tile_index(self):
+        tiles = markers.zoom_markers(SITES, LONLATS, 2, 0)
+        assert markers.tile_index(tiles) == ["0/2", "2/1"]
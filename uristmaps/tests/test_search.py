@@ -0,0 +1,28 @@
+from uristmaps import search
+
+
+SITES = [{"id": "1", "name": "The Gr\xe9at Hall", "type": "town", "owner": "The Guilds of Iron"},
+         {"id": "2", "name": "ghost halls", "type": "dark fortress"},
+         {"id": "3", "name": "Abbeyhall", "type": "town"}]
+
+
+class TestSearch:
+
+    def test_words(self):
+        assert search.site_words(SITES[0]) == {"the", "great", "hall", "town", "guilds", "of", "iron"}
+        assert search.words("dark-pits, 2") == ["dark", "pits", "2"]
+
+    def test_type_pages(self):
+        types, pages = search.type_pages(SITES, page_size=1)
+        assert types == [{"type": "dark fortress", "key": "dark_fortress", "count": 1, "pages": 1},
+                         {"type": "town", "key": "town", "count": 2, "pages": 2}]
+        # Sorted by name
+        assert [site["id"] for site in pages[("town", 0)] + pages[("town", 1)]] == ["3", "1"]
+
+    def test_prefix_shards(self):
+        shards = search.prefix_shards(SITES)
+        assert [site["id"] for site in shards["ha"]] == ["2", "1"]
+        assert [site["id"] for site in shards["to"]] == ["3", "1"]
+        assert [site["id"] for site in shards["gr"]] == ["1"]
+        # Only the start of the words is indexed
+        assert "al" not in shards
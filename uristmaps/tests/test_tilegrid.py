@@ -0,0 +1,54 @@
+import numpy as np
+
+from uristmaps import tilegrid
+
+
+NAMES = ["grassland", "ocean", "", "town"]
+
+
+def snapshot(names, struct_offset, biome_grid, struct_grid):
+    return {"names": np.array(names), "struct_offset": struct_offset,
+            "biome_grid": biome_grid, "struct_grid": struct_grid}
+
+
+class TestTilegrid:
+
+    def test_changed_cells(self):
+        biomes = np.zeros((4, 4), dtype=np.uint8)
+        biomes[:, 2:] = 1
+        structs = np.zeros((4, 4), dtype=np.uint16)
+        structs[1, 1] = 1
+
+        # The same world with the names in another order and a river that is gone now
+        old_biomes = 1 - biomes
+        old_structs = np.where(structs == 1, 2, 0).astype(np.uint16)
+        old_structs[3, 0] = 1
+        old = snapshot(["ocean", "grassland", "", "river", "town"], 2, old_biomes, old_structs)
+
+        # One biome changed from grassland to ocean
+        biomes[0, 0] = 1
+        changed = tilegrid.changed_cells(old, NAMES, 2, biomes, structs)
+        assert sorted(zip(*np.nonzero(changed))) == [(0, 0), (3, 0)]
+
+    def test_dirty_tiles(self):
+        # 300 world tiles on 512px, 106 tiles are kept clear on each side
+        changed = np.zeros((300, 300), dtype=bool)
+        changed[0, 0] = True
+        changed[150, 200] = True
+
+        assert tilegrid.tile_geometry(1, 1, 300) == (106, 256)
+        assert tilegrid.dirty_tiles(1, 1, changed) == [(0, 0), (1, 1)]
+        assert tilegrid.dirty_tiles(2, 1, changed) == [(0, 0), (2, 2)]
+        # Below zoom_offset one tile covers more than the world
+        assert tilegrid.dirty_tiles(0, 1, changed) == [(0, 0)]
+
+    def test_nothing_changed(self):
+        assert tilegrid.dirty_tiles(3, 1, np.zeros((300, 300), dtype=bool)) == []
+
+    def test_failed_levels(self):
+        # A failing native tile breaks all levels scaled down from it
+        assert tilegrid.failed_levels({5}, [4, 3, 2, 1]) == {5, 4, 3, 2, 1}
+        assert tilegrid.failed_levels({3}, [4, 3, 2, 1]) == {3, 2, 1}
+        assert tilegrid.failed_levels(set(), [4, 3, 2, 1]) == set()
+        # Native levels do not depend on each other
+        assert tilegrid.failed_levels({2}, []) == {2}
@@ -0,0 +1,110 @@
+import sqlite3
+
+import pytest
+
+from uristmaps import tilestore
+
+
+class TestFileStore:
+
+    def test_put_get(self, tmpdir):
+        store = tilestore.FileStore(str(tmpdir))
+        assert store.get(2, 1, 3) is None
+        store.put(2, 1, 3, b"tile")
+        assert store.get(2, 1, 3) == b"tile"
+        assert tmpdir.join("2", "1", "3.png").read_binary() == b"tile"
+
+    def test_link(self, tmpdir):
+        store = tilestore.FileStore(str(tmpdir))
+        # Nothing to link to yet
+        assert not store.link("2-ocean", 2, 0, 0)
+        assert store.get(2, 0, 0) is None
+
+        store.put(2, 0, 0, b"ocean", key="2-ocean")
+        assert store.link("2-ocean", 2, 1, 0)
+        assert store.get(2, 1, 0) == b"ocean"
+        assert tmpdir.join("shared", "2-ocean.png").check()
+
+        # Replacing a linked tile leaves the shared image alone
+        store.put(2, 1, 0, b"land")
+        assert store.get(2, 1, 0) == b"land"
+        assert store.get(2, 0, 0) == b"ocean"
+
+    def test_clear_shared(self, tmpdir):
+        store = tilestore.FileStore(str(tmpdir))
+        store.put(2, 0, 0, b"ocean", key="2-ocean")
+        store.put(3, 0, 0, b"ocean", key="3-ocean")
+        store.clear_shared(2)
+        assert not store.link("2-ocean", 2, 1, 0)
+        assert store.link("3-ocean", 3, 1, 0)
+        # The tiles themselves stay
+        assert store.get(2, 0, 0) == b"ocean"
+
+
+class TestMBTilesStore:
+
+    def open(self, tmpdir, batch_size=512):
+        return tilestore.MBTilesStore(str(tmpdir.join("tiles.mbtiles")), batch_size)
+
+    def test_put_get(self, tmpdir):
+        store = self.open(tmpdir)
+        store.put(2, 1, 0, b"tile")
+        store.flush()
+        assert store.get(2, 1, 0) == b"tile"
+        assert store.get(2, 1, 1) is None
+        store.close()
+
+        # The rows are counted from the bottom
+        connection = sqlite3.connect(str(tmpdir.join("tiles.mbtiles")))
+        assert connection.execute("SELECT zoom_level, tile_column, tile_row FROM tiles").fetchall() == [(2, 1, 3)]
+        connection.close()
+        assert tilestore.MBTilesStore.tile_row(0, 0) == 0
+
+    def test_batches(self, tmpdir):
+        store = self.open(tmpdir, batch_size=2)
+        reader = self.open(tmpdir)
+        store.put(1, 0, 0, b"a")
+        assert reader.get(1, 0, 0) is None
+        # The second tile fills the batch and writes both
+        store.put(1, 1, 0, b"b")
+        assert reader.get(1, 0, 0) == b"a" and reader.get(1, 1, 0) == b"b"
+        store.put(1, 0, 1, b"c")
+        store.close()
+        assert reader.get(1, 0, 1) == b"c"
+        reader.close()
+
+    def test_link_and_prune(self, tmpdir):
+        store = self.open(tmpdir)
+        assert not store.link("2-ocean", 2, 0, 0)
+
+        store.put(2, 0, 0, b"ocean", key="2-ocean")
+        # Links to pending and to written images
+        assert store.link("2-ocean", 2, 1, 0)
+        store.flush()
+        assert store.link("2-ocean", 2, 2, 0)
+        store.put(2, 3, 0, b"land")
+        store.flush()
+        assert [store.get(2, x, 0) for x in range(4)] == [b"ocean", b"ocean", b"ocean", b"land"]
+
+        # Replaced images are pruned, shared ones are kept while they are used
+        store.put(2, 3, 0, b"hills")
+        store.prune()
+        images = store.connection.execute("SELECT tile_data FROM images ORDER BY tile_data").fetchall()
+        assert [bytes(row[0]) for row in images] == [b"hills", b"ocean"]
+
+        store.clear_shared(2)
+        assert not store.link("2-ocean", 2, 0, 1)
+        store.close()
+
+    def test_readonly(self, tmpdir):
+        store = self.open(tmpdir)
+        reader = tilestore.MBTilesStore(str(tmpdir.join("tiles.mbtiles")), readonly=True)
+        store.put(2, 1, 0, b"tile")
+        assert reader.get(2, 1, 0) is None
+        store.flush()
+        assert reader.get(2, 1, 0) == b"tile"
+
+        reader.put(2, 0, 0, b"tile")
+        with pytest.raises(sqlite3.OperationalError):
+            reader.flush()
+        store.close()
@@ -0,0 +1,63 @@
+""" How the world is laid out on the map tiles of each level and which of
+the tiles show a part of the world that has changed since the last render.
+"""
+import math
+
+import numpy as np
+
+
+def tile_geometry(level, zoom_offset, worldsize):
+    """ Calculate how the world is laid out on the tiles of the level.
+
+    Returns the tuple (clear_tiles, cells_per_tile): The amount of world tiles
+    that are kept clear left and top to center the world render and the
+    amount of world tiles along one side of a tile in this level. This also
+    works for the levels below zoom_offset that are scaled down in pyramid mode.
+    """
+    clear_tiles = 256 * int(math.pow(2, zoom_offset)) - worldsize
+    clear_tiles //= 2 # Half it to get the offset left and top of the world.
+
+    cells_per_tile = 256 * int(math.pow(2, zoom_offset)) // int(math.pow(2, level))
+    return clear_tiles, cells_per_tile
+
+
+def changed_cells(snapshot, names, struct_offset, biome_grid, struct_grid):
+    """ Compare the world with the snapshot of an older world.
+
+    snapshot is a mapping with the names, struct_offset, biome_grid and
+    struct_grid of the older world, like the render snapshots. Returns a
+    boolean grid marking the world tiles with a different biome or structure.
+    """
+    # The name indices of both worlds might differ, so translate the snapshot's
+    # indices into the current ones before comparing. Unknown names become -1.
+    name_index = {name: index for index, name in enumerate(names)}
+    translate = np.array([name_index.get(name, -1) for name in snapshot["names"].tolist()])
+
+    old_structs = snapshot["struct_grid"].astype(np.int64) + int(snapshot["struct_offset"])
+    return (translate[snapshot["biome_grid"]] != biome_grid) | \
+           (translate[old_structs] != struct_grid.astype(np.int64) + struct_offset)
+
+
+def dirty_tiles(level, zoom_offset, changed):
+    """ Find the tiles of the level that contain at least one changed world tile.
+    """
+    clear_tiles, cells_per_tile = tile_geometry(level, zoom_offset, changed.shape[0])
+
+    ys, xs = np.nonzero(changed)
+    tiles = np.unique(np.stack(((xs + clear_tiles) // cells_per_tile,
+                                (ys + clear_tiles) // cells_per_tile), axis=1), axis=0)
+    return [tuple(tile) for tile in tiles.tolist()]
+
+
+def failed_levels(failed, scaled_levels):
+    """ Add the levels that were built from the tiles of failed levels.
+
+    Each of the scaled_levels is built in the given order from the level
+    above, so it is as broken as that level. Returns the set of all levels
+    that must not be remembered as rendered.
+    """
+    failed = set(failed)
+    for level in scaled_levels:
+        if level + 1 in failed:
+            failed.add(level)
+    return failed
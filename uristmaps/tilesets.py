@@ -7,26 +7,24 @@ from uristmaps.config import conf
 tiles_dir = conf["Paths"]["tiles"]
 tilesets_dir = conf["Paths"]["tilesets"]
 
-def make_tileset(directory):
-    """ Create a tileset image from all images in the
-    given directory. The name of the directory is the size of the single tiles.
+def pack(files, tile_size, background="white"):
+    """ Paste the images into the smallest square sheet that can contain all of them.
+    Images that are not tile_size big are scaled to that size.
 
-    Also creates an index json file specifying the coordinates of each image file
-    in this tileset.
+    Returns the sheet image and the index that maps the name of each image file
+    (without extension) to the coordinates of the image within the sheet.
     """
-    tile_size = int(os.path.basename(directory))
-
-    files = glob.glob("{}/*.*".format(directory))
-
     # Create the smallest square image that can contain all tiles
     image_size = math.ceil(math.sqrt(len(files)))
-    tile_image = Image.new("RGBA", (image_size * tile_size, image_size * tile_size), "white")
+    tile_image = Image.new("RGBA", (image_size * tile_size, image_size * tile_size), background)
 
     # The image index stores the locations of the tiles within the tileset
     img_index = {}
     x,y = 0,0
     for img_file in files:
-        tile_img = Image.open(img_file)
+        tile_img = Image.open(img_file).convert("RGBA")
+        if tile_img.size != (tile_size, tile_size):
+            tile_img = tile_img.resize((tile_size, tile_size), Image.LANCZOS)
         tile_image.paste(tile_img, (x * tile_size, y * tile_size))
 
         img_index[os.path.splitext(os.path.basename(img_file))[0]] = (x * tile_size, y * tile_size)
@@ -35,6 +33,20 @@ def make_tileset(directory):
             y += 1
         else:
             x += 1
+    return tile_image, img_index
+
+
+def make_tileset(directory):
+    """ Create a tileset image from all images in the
+    given directory. The name of the directory is the size of the single tiles.
+
+    Also creates an index json file specifying the coordinates of each image file
+    in this tileset.
+    """
+    tile_size = int(os.path.basename(directory))
+
+    files = glob.glob("{}/*.*".format(directory))
+    tile_image, img_index = pack(files, tile_size)
 
     # Make sure the tilesets directory exists
     if not os.path.exists(tilesets_dir):
@@ -44,6 +56,29 @@ def make_tileset(directory):
         jsonfile.write(json.dumps(img_index))
     tile_image.save(os.path.join(tilesets_dir, "{}.png".format(tile_size)))
 
+
+def make_sprites(name, files, tile_size, target_dir):
+    """ Pack the images into the sprite sheet <name>.png in the target directory
+    and write the stylesheet <name>.css for it.
+
+    Each image is shown by an element with the classes "sprite-<name>" and
+    "sprite-<name>-<image name>".
+    """
+    tile_image, img_index = pack(sorted(files), tile_size, background=(0, 0, 0, 0))
+
+    rules = [".sprite-{} {{ display: inline-block; width: {}px; height: {}px; "
+             "vertical-align: middle; background: url(\"{}.png\") no-repeat; }}".format(
+                 name, tile_size, tile_size, name)]
+    for img_name, (x, y) in sorted(img_index.items()):
+        rules.append(".sprite-{}-{} {{ background-position: {}px {}px; }}".format(name, img_name, -x, -y))
+
+    if not os.path.exists(target_dir):
+        os.makedirs(target_dir)
+    tile_image.save(os.path.join(target_dir, "{}.png".format(name)))
+    with open(os.path.join(target_dir, "{}.css".format(name)), "w") as cssfile:
+        cssfile.write("\n".join(rules) + "\n")
+
+
 def get_tileset(image_size):
     """ Create a dictionary of tiles from the tileset with the given size.
 
@@ -0,0 +1,246 @@
+""" Storage backends for the rendered map tiles.
+
+The FileStore writes every tile as its own file in the {z}/{x}/{y}.png layout
+leaflet requests them in. The MBTilesStore packs all tiles into a single
+SQLite database following the MBTiles specification.
+
+Both stores support sharing one image between many tiles: a tile can be put
+with a key and other tiles can then be linked to the image with that key.
+"""
+import os, glob, shutil, sqlite3, hashlib, threading
+from urllib.request import pathname2url
+
+
+class FileStore:
+    """ Store each tile as a file in a directory. Shared images are kept
+    in the 'shared' subdirectory and hardlinked to the tile paths.
+    """
+
+    def __init__(self, directory, extension="png"):
+        self.directory = directory
+        self.extension = extension
+
+    def tile_file(self, level, tile_x, tile_y):
+        """ The path of the image file for the given tile.
+        """
+        return os.path.join(self.directory, str(level), str(tile_x),
+                            "{}.{}".format(tile_y, self.extension))
+
+    def shared_file(self, key):
+        """ The path of the image file that is shared by all tiles with the given key.
+        """
+        return os.path.join(self.directory, "shared", "{}.{}".format(key, self.extension))
+
+    def get(self, level, tile_x, tile_y):
+        """ Read the encoded image of the tile. Returns None when the tile does not exist.
+        """
+        fname = self.tile_file(level, tile_x, tile_y)
+        if not os.path.exists(fname):
+            return None
+        with open(fname, "rb") as tile:
+            return tile.read()
+
+    def put(self, level, tile_x, tile_y, data, key=None):
+        """ Store the encoded image of the tile.
+
+        When a key is given the image is stored once as a shared file and the
+        tile is linked to it.
+        """
+        if key:
+            shared = self.shared_file(key)
+            os.makedirs(os.path.dirname(shared), exist_ok=True)
+            self.write_file(shared, data)
+            self.link(key, level, tile_x, tile_y)
+            return
+
+        fname = self.tile_file(level, tile_x, tile_y)
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        self.write_file(fname, data)
+
+    def write_file(self, fname, data):
+        """ Write to a file of this process and thread first and move it into
+        place. Other processes might produce the same shared image at the same
+        time and readers must not see half written tiles. Replacing the file
+        also keeps an old hardlink to a shared image from being overwritten.
+        """
+        tmp_file = "{}.{}-{}.tmp".format(fname, os.getpid(), threading.get_ident())
+        with open(tmp_file, "wb") as tile:
+            tile.write(data)
+        os.replace(tmp_file, fname)
+
+    def link(self, key, level, tile_x, tile_y):
+        """ Make the tile a hardlink to the shared image with the given key.
+        Falls back to a copy on file systems without hardlinks.
+
+        Returns False when there is no shared image for the key yet.
+        """
+        shared = self.shared_file(key)
+        if not os.path.exists(shared):
+            return False
+
+        fname = self.prepare_tile_file(level, tile_x, tile_y)
+        try:
+            os.link(shared, fname)
+        except OSError:
+            shutil.copyfile(shared, fname)
+        return True
+
+    def clear_shared(self, level):
+        """ Delete the shared images of the level, so the next render creates
+        them again instead of linking to images of an older render.
+        """
+        for fname in glob.glob(self.shared_file("{}-*".format(level))):
+            os.remove(fname)
+
+    def prepare_tile_file(self, level, tile_x, tile_y):
+        """ Make sure the directory of the tile exists and there is no old file
+        for it. The old file might be a link to a shared image that must not
+        be overwritten.
+        """
+        fname = self.tile_file(level, tile_x, tile_y)
+
+        # Other processes might create the same directory at the same time
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        if os.path.exists(fname):
+            os.remove(fname)
+        return fname
+
+    def set_metadata(self, metadata):
+        pass
+
+    def flush(self):
+        pass
+
+    def prune(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class MBTilesStore:
+    """ Store the tiles in an MBTiles database.
+
+    Uses the deduplicating layout of the specification: the images table
+    holds every distinct image once and the map table points the tiles at
+    them. Images without a key are identified by their content hash.
+
+    Writes are collected and inserted in batches of batch_size tiles, each
+    batch in a single transaction. Call flush or close to write the rest.
+
+    A readonly store opens an existing database for reading only. Readers
+    do not block each other or the writer.
+    """
+
+    def __init__(self, path, batch_size=512, readonly=False):
+        self.path = path
+        self.batch_size = batch_size
+
+        # Writes that are not yet in the database
+        self.pending_images = {}
+        self.pending_map = []
+
+        if readonly:
+            self.connection = sqlite3.connect("file:{}?mode=ro".format(pathname2url(path)),
+                                              timeout=300, uri=True)
+            return
+
+        # Several render processes write into the database at the same time,
+        # wait for the others instead of failing when it is locked.
+        self.connection = sqlite3.connect(path, timeout=300, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        with self.connection:
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS metadata (name TEXT, value TEXT);
+                CREATE UNIQUE INDEX IF NOT EXISTS metadata_index ON metadata (name);
+                CREATE TABLE IF NOT EXISTS map (zoom_level INTEGER, tile_column INTEGER,
+                                                tile_row INTEGER, tile_id TEXT);
+                CREATE UNIQUE INDEX IF NOT EXISTS map_index ON map (zoom_level, tile_column, tile_row);
+                CREATE TABLE IF NOT EXISTS images (tile_data BLOB, tile_id TEXT);
+                CREATE UNIQUE INDEX IF NOT EXISTS images_id ON images (tile_id);
+                CREATE VIEW IF NOT EXISTS tiles AS
+                    SELECT map.zoom_level AS zoom_level, map.tile_column AS tile_column,
+                           map.tile_row AS tile_row, images.tile_data AS tile_data
+                    FROM map JOIN images ON images.tile_id = map.tile_id;
+            """)
+
+    @staticmethod
+    def tile_row(level, tile_y):
+        """ MBTiles counts the rows from the bottom while leaflet counts from the top.
+        """
+        return 2 ** level - 1 - tile_y
+
+    def set_metadata(self, metadata):
+        """ Write the entries of the metadata dict into the metadata table.
+        """
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO metadata (name, value) VALUES (?, ?)",
+                                        [(name, str(value)) for name, value in metadata.items()])
+
+    def get(self, level, tile_x, tile_y):
+        """ Read the encoded image of the tile. Returns None when the tile does not exist.
+        """
+        row = self.connection.execute(
+            "SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+            (level, tile_x, self.tile_row(level, tile_y))).fetchone()
+        if row is None:
+            return None
+        return bytes(row[0])
+
+    def put(self, level, tile_x, tile_y, data, key=None):
+        """ Store the encoded image of the tile. The image is shared under
+        the key if one is given.
+        """
+        tile_id = key or hashlib.sha1(data).hexdigest()
+        self.pending_images[tile_id] = data
+        self.add_map_entry(level, tile_x, tile_y, tile_id)
+
+    def link(self, key, level, tile_x, tile_y):
+        """ Point the tile at the shared image with the given key.
+
+        Returns False when there is no shared image for the key yet.
+        """
+        if key not in self.pending_images:
+            row = self.connection.execute("SELECT 1 FROM images WHERE tile_id = ?", (key,)).fetchone()
+            if row is None:
+                return False
+        self.add_map_entry(level, tile_x, tile_y, key)
+        return True
+
+    def clear_shared(self, level):
+        """ Delete the shared images of the level, so the next render creates
+        them again instead of linking to images of an older render.
+        The images without a key are named by their hash which contains no "-".
+        """
+        self.flush()
+        with self.connection:
+            self.connection.execute("DELETE FROM images WHERE tile_id LIKE ?", ("{}-%".format(level),))
+
+    def add_map_entry(self, level, tile_x, tile_y, tile_id):
+        self.pending_map.append((level, tile_x, self.tile_row(level, tile_y), tile_id))
+        if len(self.pending_map) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """ Insert all pending tiles in one transaction.
+        """
+        if not self.pending_map and not self.pending_images:
+            return
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO images (tile_id, tile_data) VALUES (?, ?)",
+                                        self.pending_images.items())
+            self.connection.executemany("INSERT OR REPLACE INTO map (zoom_level, tile_column, tile_row, tile_id) "
+                                        "VALUES (?, ?, ?, ?)", self.pending_map)
+        self.pending_images = {}
+        self.pending_map = []
+
+    def prune(self):
+        """ Delete the images that are no longer used by any tile.
+        """
+        self.flush()
+        with self.connection:
+            self.connection.execute("DELETE FROM images WHERE tile_id NOT IN (SELECT tile_id FROM map)")
+
+    def close(self):
+        self.flush()
+        self.connection.close()
@@ -25,6 +25,9 @@ def copy_dir(src, dst):
         for f in files:
             copy(pjoin(root, f), 
                  pjoin(dst, f))
+        # The subdirectories have been copied by the calls above, os.walk would
+        # otherwise put the files of nested directories directly into dst
+        break
 
 
 def copy(src,dst):
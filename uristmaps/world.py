@@ -0,0 +1,74 @@
+""" The world manifest describes the size of the world and how it is laid out
+on the map.
+
+It is written to build/world.json when the world is loaded from the export,
+so the later stages only have to read this tiny file instead of loading the
+world to find out its size.
+"""
+import os, json, hashlib
+
+from uristmaps.config import conf
+
+
+def manifest_file():
+    return os.path.join(conf["Paths"]["build"], "world.json")
+
+
+def calc_zoom_offset(worldsize):
+    """ Determine wich will be the first zoom level to use graphic tiles
+    bigger than 1px.
+
+    Zoom level 'zoom_offset' will be the first in which the world can
+    be rendered onto the map using 1px sized tiles.
+    """
+    zoom_offset = 0
+    mapsize = 256
+    while mapsize < worldsize:
+        mapsize *= 2
+        zoom_offset += 1
+    return zoom_offset
+
+
+def calc_map_zoom(worldsize):
+    """ Find the minimum zoom level to fit all world coordinates in a
+    rendered map using 1px big tiles and the offset of the world within
+    the map area at this level.
+
+    Returns the tuple (zoom, offset).
+    """
+    zoom = 0
+    while 2 ** zoom < worldsize:
+        zoom += 1
+    return zoom, (2 ** zoom - worldsize) // 2
+
+
+def file_hash(fname):
+    sha = hashlib.sha1()
+    with open(fname, "rb") as source:
+        for block in iter(lambda: source.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def write_manifest(worldsize, sources):
+    """ Write the manifest for a world of the given size.
+
+    sources maps the names of the export files the world was loaded from
+    to their paths. Their hashes are stored in the manifest.
+    """
+    zoom, offset = calc_map_zoom(worldsize)
+    manifest = {"worldsize": worldsize,
+                "zoom_offset": calc_zoom_offset(worldsize),
+                "zoom": zoom,
+                "offset": offset,
+                "sources": {name: {"file": os.path.basename(fname), "sha1": file_hash(fname)}
+                            for name, fname in sources.items()}}
+
+    os.makedirs(conf["Paths"]["build"], exist_ok=True)
+    with open(manifest_file(), "w") as manifestjson:
+        manifestjson.write(json.dumps(manifest, indent=2))
+
+
+def load_manifest():
+    with open(manifest_file()) as manifestjson:
+        return json.loads(manifestjson.read())